@@ -0,0 +1,227 @@
+import json
+import os
+import sys
+import argparse
+import platform
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import craft_planner
+
+# Benchmarks the planner over a corpus of crafting problems and checks the results against an
+# earlier run. Every (scenario, configuration) pair runs in a fresh process, so the memory
+# figure is that search's own, and the plan it returns is replayed to make sure it really
+# reaches the goal. The results are printed (or written with --output) as one JSON document:
+#   {"python": ..., "results": [{"scenario", "config", "cost", "optimal", "time",
+#                                "states_searched", "peak_memory_kb", "valid"}, ...],
+#    "failures": [...]}
+# Run it with --baseline set to an earlier output and any scenario that got a worse plan,
+# lost its plan, or searched more than --node-tolerance more states is a failure, as is a
+# wrong plan or an exact configuration missing the known optimal cost. The exit status is 1
+# if anything failed.
+
+# Search configurations: name -> (search mode, heuristic) as plan_problem takes them. The
+# first run of astar-pdb on a problem also builds its pattern databases, so it is slow.
+CONFIGS = {
+    'astar-prune': ('astar', 'prune'),
+    'astar-capped-bound': ('astar', 'capped-bound'),
+    'astar-pdb': ('astar', 'pdb'),
+    'counts': ('counts', 'prune'),
+}
+# The configurations that always find optimal plans
+EXACT_CONFIGS = {'astar-capped-bound', 'astar-pdb'}
+
+# The corpus. 'crafting' is a file next to this one, a synthetic domain ('synthetic-T-W', see
+# synthetic_domain) or 'batched-bench' (see batched_bench_domain); 'initial' and 'goal' default
+# to the file's own; 'optimal' is the best cost where it is known.
+SCENARIOS = [
+    {'name': 'wooden_pickaxe', 'goal': {'wooden_pickaxe': 1}, 'optimal': 18},
+    {'name': 'stone_pickaxe', 'goal': {'stone_pickaxe': 1}, 'optimal': 31},
+    {'name': 'iron_pickaxe', 'goal': {'iron_pickaxe': 1}, 'optimal': 83},
+    {'name': 'cart', 'goal': {'cart': 1}, 'optimal': 104},
+    {'name': 'rail-40', 'goal': {'rail': 40}, 'optimal': 235},
+    {'name': 'cart-3-rail-32', 'goal': {'cart': 3, 'rail': 32}, 'optimal': 304},
+    {'name': 'full', 'optimal': 311},
+    {'name': 'stocked-cart-2-rail-20', 'initial': {'iron_pickaxe': 1, 'bench': 1, 'furnace': 1},
+     'goal': {'cart': 2, 'rail': 20}, 'optimal': 186},
+    {'name': 'stocked-iron-tools', 'initial': {'plank': 4, 'stone_pickaxe': 1},
+     'goal': {'iron_pickaxe': 1, 'iron_axe': 1}, 'optimal': 83},
+    {'name': 'synthetic-2-3', 'crafting': 'synthetic-2-3', 'optimal': 85},
+    {'name': 'synthetic-3-4', 'crafting': 'synthetic-3-4', 'optimal': 130},
+    {'name': 'batched-bench', 'crafting': 'batched-bench', 'goal': {'wooden_pickaxe': 1}, 'optimal': 18},
+]
+
+
+def synthetic_domain(tiers, width):
+    # The bundled domain with tiers x width more items on top. Each tier has a jig (a tool
+    # made from the tier below, needed for every recipe in the tier) and width parts, each
+    # made from two kinds of part in the tier below, or from ingots and planks in the first
+    # tier. There are two recipes per part: a quick one that needs the jig and a slow one
+    # that doesn't. The goal is the last tier's first part.
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, 'crafting.json')) as f:
+        crafting = json.load(f)
+    items = crafting['Items']
+    recipes = crafting['Recipes']
+    below = ['ingot', 'plank']
+    for tier in range(1, tiers + 1):
+        jig = 'jig_%d' % tier
+        parts = ['part_%d_%d' % (tier, n) for n in range(width)]
+        items += [jig] + parts
+        recipes['craft %s at bench' % jig] = {'Produces': {jig: 1}, 'Requires': {'bench': True},
+                                              'Consumes': {below[0]: 1, 'stick': 1}, 'Time': 2}
+        for n, part in enumerate(parts):
+            consumes = {below[n % len(below)]: 1}
+            consumes[below[(n + 1) % len(below)]] = consumes.get(below[(n + 1) % len(below)], 0) + 1
+            recipes['craft %s with %s' % (part, jig)] = {'Produces': {part: 1}, 'Requires': {jig: True},
+                                                          'Consumes': consumes, 'Time': 1}
+            recipes['craft %s by hand' % part] = {'Produces': {part: 1}, 'Consumes': consumes, 'Time': 5}
+        below = parts
+    crafting['Items'] = sorted(items)
+    crafting['Initial'] = {}
+    crafting['Goal'] = {below[0]: 1}
+    return crafting
+
+
+def batched_bench_domain():
+    # The bundled domain with the bench made two at a time, so a plan has to hold more of a
+    # tool than it needs (the derived caps once pruned every way to make one)
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crafting.json')) as f:
+        crafting = json.load(f)
+    crafting['Recipes']['craft bench']['Produces'] = {'bench': 2}
+    return crafting
+
+
+def crafting_path(name, cache_dir):
+    # The file for a scenario's 'crafting', writing generated domains into cache_dir
+    if not name.startswith(('synthetic-', 'batched-')):
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    path = os.path.join(cache_dir, name + '.json')
+    if not os.path.exists(path):
+        if name == 'batched-bench':
+            crafting = batched_bench_domain()
+        else:
+            tiers, width = name.split('-')[1:]
+            crafting = synthetic_domain(int(tiers), int(width))
+        os.makedirs(cache_dir, exist_ok=True)
+        craft_planner.write_atomically(path, json.dumps(crafting).encode())
+    return path
+
+
+def bench_run(initial, goal, limit, search_mode, heuristic_name):
+    # Runs in a fresh worker process: plan_problem, plus the peak memory the search added and
+    # whether its plan really gets from initial to goal
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result = craft_planner.plan_problem(None, initial, goal, limit, search_mode, heuristic_name)
+    result['peak_memory_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    result['valid'] = None
+    if result['actions'] is not None:
+        crafting, item_index, _ = craft_planner.worker_domain
+        state = tuple(initial.get(item, 0) for item in crafting['Items'])
+        try:
+            plan = craft_planner.replay_plan(crafting, item_index, state, result['actions'])
+            end = plan[-1][0] if plan else state
+            result['valid'] = all(end[item_index[item]] >= amount for item, amount in goal.items())
+        except ValueError:
+            result['valid'] = False
+    return result
+
+
+def run_benchmarks(scenarios, configs, limit, cache_dir):
+    # Yields a result dict per (scenario, configuration), in order
+    spawn = multiprocessing.get_context('spawn')
+    for scenario in scenarios:
+        path = crafting_path(scenario.get('crafting', 'crafting.json'), cache_dir)
+        craft_planner.load_compiled_domain(path, cache_dir)
+        with open(path) as f:
+            crafting = json.load(f)
+        initial = scenario.get('initial', crafting['Initial'])
+        goal = scenario.get('goal', crafting['Goal'])
+        # One process per run, so each one's peak memory is its own
+        with ProcessPoolExecutor(1, mp_context=spawn, initializer=craft_planner.init_batch_worker,
+                                 initargs=(path, cache_dir), max_tasks_per_child=1) as pool:
+            for config in configs:
+                search_mode, heuristic_name = CONFIGS[config]
+                result = pool.submit(bench_run, initial, goal, limit, search_mode, heuristic_name).result()
+                yield {'scenario': scenario['name'], 'config': config, 'cost': result['cost'],
+                       'optimal': scenario.get('optimal'), 'time': result['time'],
+                       'states_searched': result['states_searched'], 'peak_memory_kb': result['peak_memory_kb'],
+                       'valid': result['valid']}
+
+
+def find_failures(results, baseline=None, node_tolerance=0.1):
+    # Describes everything wrong with results, on their own and against a baseline run's
+    failures = []
+    earlier = {(result['scenario'], result['config']): result for result in (baseline or {}).get('results', [])}
+    for result in results:
+        name = '%s/%s' % (result['scenario'], result['config'])
+        cost = result['cost']
+        if result['valid'] is False:
+            failures.append(name + ': plan does not reach the goal')
+        if cost is None and result['optimal'] is not None and result['config'] in EXACT_CONFIGS:
+            failures.append('%s: no plan, optimal is %s' % (name, result['optimal']))
+        if result['optimal'] is not None and cost is not None:
+            if cost < result['optimal']:
+                failures.append('%s: cost %s is below the optimum %s' % (name, cost, result['optimal']))
+            elif result['config'] in EXACT_CONFIGS and cost != result['optimal']:
+                failures.append('%s: cost %s, optimal is %s' % (name, cost, result['optimal']))
+        before = earlier.get((result['scenario'], result['config']))
+        if before is None or before['cost'] is None:
+            continue
+        if cost is None:
+            failures.append('%s: no plan, baseline cost %s' % (name, before['cost']))
+            continue
+        if cost > before['cost']:
+            failures.append('%s: cost %s, baseline %s' % (name, cost, before['cost']))
+        if result['states_searched'] > before['states_searched'] * (1 + node_tolerance):
+            failures.append('%s: %d states searched, baseline %d' % (name, result['states_searched'],
+                                                                      before['states_searched']))
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the crafting planner over a scenario corpus.')
+    parser.add_argument('--scenarios', nargs='*', default=None,
+                        help='scenario names to run (default: all of them: %s)'
+                             % ', '.join(scenario['name'] for scenario in SCENARIOS))
+    parser.add_argument('--configs', nargs='*', choices=sorted(CONFIGS), default=sorted(CONFIGS),
+                        help='search configurations to run (default: all)')
+    parser.add_argument('--limit', type=float, default=60, help='time limit in seconds per search')
+    parser.add_argument('--baseline', default=None, help='an earlier output to check this run against')
+    parser.add_argument('--node-tolerance', type=float, default=0.1,
+                        help='fraction more states than the baseline searched that counts as a regression')
+    parser.add_argument('--output', default=None, help='write the results here instead of printing them')
+    parser.add_argument('--cache-dir', default=None,
+                        help='where compiled and synthetic domains are kept (default: .craft_cache next to this file)')
+    args = parser.parse_args()
+
+    cache_dir = args.cache_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), '.craft_cache')
+    scenarios = SCENARIOS
+    if args.scenarios is not None:
+        names = {scenario['name'] for scenario in SCENARIOS}
+        unknown = [name for name in args.scenarios if name not in names]
+        if unknown:
+            parser.error('unknown scenarios: ' + ', '.join(unknown))
+        scenarios = [scenario for scenario in SCENARIOS if scenario['name'] in args.scenarios]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = []
+    for result in run_benchmarks(scenarios, args.configs, args.limit, cache_dir):
+        print('%-24s %-20s cost %-6s %8.3fs %9s states %8d KB' % (
+            result['scenario'], result['config'], result['cost'], result['time'] or 0, result['states_searched'],
+            result['peak_memory_kb']), file=sys.stderr)
+        results.append(result)
+    failures = find_failures(results, baseline, args.node_tolerance)
+    for failure in failures:
+        print('FAIL', failure, file=sys.stderr)
+    report = json.dumps({'python': platform.python_version(), 'results': results, 'failures': failures}, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+    sys.exit(1 if failures else 0)
@@ -1,8 +1,25 @@
 import json
+import os
+import argparse
+import asyncio
+import sys
+import types
+import marshal
+import mmap
+import linecache
+import cProfile
+import hashlib
+import contextlib
+import queue
+import multiprocessing
 from collections import namedtuple, defaultdict, OrderedDict
 from timeit import default_timer as time
 from math import inf, ceil
 from heapq import heappop, heappush
+from operator import add, sub, mul, ge
+from itertools import count, product
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 Recipe = namedtuple('Recipe', ['name', 'check', 'effect', 'cost'])
 
@@ -35,61 +52,77 @@ class State(OrderedDict):
         return str(dict(item for item in self.items() if item[1] > 0))
 
 
-def make_checker(rule):
+def make_state_view(items):
+    # Returns a function turning a compact state vector back into a State, so plans
+    # can still be printed item by item. This is only used on the final plan.
+
+    def state_view(vector):
+        return State(zip(items, vector))
+
+    return state_view
+
+
+def rule_vectors(rule, item_index):
+    # Turns a rule into two lists with one slot per item: the minimum count of every item
+    # the rule needs before it can fire (a required tool just needs to be present), and how
+    # much of every item it adds (negative for consumed items).
+    need = [0] * len(item_index)
+    delta = [0] * len(item_index)
+    for item, condition in rule.get('Requires', {}).items():
+        need[item_index[item]] = 1 if condition else 0
+    for item, amount in rule.get('Consumes', {}).items():
+        need[item_index[item]] = max(need[item_index[item]], amount)
+        delta[item_index[item]] -= amount
+    for item, amount in rule['Produces'].items():
+        delta[item_index[item]] += amount
+    return need, delta
+
+
+def make_checker(rule, item_index):
     # Implement a function that returns a function to determine whether a state meets a
     # rule's requirements. This code runs once, when the rules are constructed before
     # the search is attempted.
 
+    # States are tuples of item counts in Crafting['Items'] order, so turn the rule into
+    # (index, minimum count) pairs once instead of walking its dicts on every call.
+    need, _ = rule_vectors(rule, item_index)
+    needs = tuple((index, amount) for index, amount in enumerate(need) if amount > 0)
+
     def check(state):
         # This code is called by graph(state) and runs millions of times.
-        # Tip: Do something with rule['Consumes'] and rule['Requires'].
-        #Check requirements
-        if "Requires" in rule:
-            for item, condition in rule['Requires'].items():
-                if state[item] != condition:
-                    return False
-
-        #Check consumption requirements
-        if "Consumes" in rule:
-            for item, condition in rule['Consumes'].items():
-                if state[item] < condition:
-                    return False
+        for index, amount in needs:
+            if state[index] < amount:
+                return False
         return True
 
     return check
 
 
-def make_effector(rule):
+def make_effector(rule, item_index):
     # Implement a function that returns a function which transitions from state to
     # new_state given the rule. This code runs once, when the rules are constructed
     # before the search is attempted.
 
+    # Precompute how much of every item the rule adds (negative for consumed items)
+    _, delta = rule_vectors(rule, item_index)
+    delta = tuple(delta)
+
     def effect(state):
         # This code is called by graph(state) and runs millions of times
-        # Tip: Do something with rule['Produces'] and rule['Consumes'].
-
-        #Check consumption requirements
-        next_state = state.copy()
-        if "Consumes" in rule:
-            for item, num_consumed in rule['Consumes'].items():
-                next_state[item] -= num_consumed
-
-        for item, num_produced in rule['Produces'].items():
-            next_state[item] += num_produced
-
-        return next_state
+        return tuple(map(add, state, delta))
 
     return effect
 
 
-def make_goal_checker(goal):
+def make_goal_checker(goal, item_index):
     # Implement a function that returns a function which checks if the state has
     # met the goal criteria. This code runs once, before the search is attempted.
+    targets = tuple((item_index[item], amount) for item, amount in goal.items())
 
     def is_goal(state):
         # This code is used in the search process and may be called millions of times.
-        for goalItem, goalAmount in goal.items():
-            if state[goalItem] < goalAmount:
+        for index, amount in targets:
+            if state[index] < amount:
                 return False
         return True
 
@@ -105,110 +138,1505 @@ def graph(state):
             yield (r.name, r.effect(state), r.cost)
 
 
-def heuristic(state, action_name):
-    # Implement your heuristic here!
-    #You should never have more than 1 wood, unless the objective is for it, should be turning it into planks instead
-    if state["wood"] > (1 if "wood" not in Crafting['Goal'] else max(Crafting["Goal"]["wood"], 1)):
-        return inf
-    #If you have wood, you should be turning it into planks, if you're not trying to gather it
-    if "wood" not in Crafting['Goal'] and  state["wood"] == 1 and "for wood" not in action_name:
-        return inf
-
-    #Don't need more than 8 cobble
-    if state["cobble"] > (8 if "cobble" not in Crafting['Goal'] else max(8, Crafting["Goal"]["cobble"])):
-        return inf
-
-    #never need more than 6 ingot since max ingot to craft is 6 with the rails
-    if state["ingot"] > (6 if "ingot" not in Crafting['Goal'] else max(6, Crafting["Goal"]["ingot"])):
-        return inf
-
-    #seems like we only need 1 cart for now subject to change
-    if state["cart"] > (1 if "cart" not in Crafting['Goal'] else Crafting["Goal"]["cart"]):
-        return inf
-
-    #Only check these requirements if you're crafting
-    if action_name[0:5] == "craft":
-        #Don't make duplicate tools
-        list_of_tools = ["bench", "furnace", "wooden_pickaxe", "stone_pickaxe", "iron_pickaxe", "wooden_axe", "stone_axe", "iron_axe"]
-        for tool in list_of_tools:
-            if state[tool] > 1:
-                return inf
+def make_graph(recipes):
+    # graph() over the given recipes instead of the global all_recipes
+    def recipe_graph(state):
+        for r in recipes:
+            if r.check(state):
+                yield (r.name, r.effect(state), r.cost)
+
+    return recipe_graph
+
+
+def index_recipes(crafting, item_index):
+    # The inverted index from items to recipes (in file order): watchers[item] lists the
+    # recipes whose preconditions mention the item, and affected[r] lists the recipes whose
+    # preconditions mention anything recipe r changes, i.e. the only ones that can go from
+    # applicable to not (or back) when r fires. This runs once per domain.
+    watchers = [[] for _ in item_index]
+    deltas = []
+    for r, rule in enumerate(crafting['Recipes'].values()):
+        need, delta = rule_vectors(rule, item_index)
+        for index, amount in enumerate(need):
+            if amount > 0:
+                watchers[index].append(r)
+        deltas.append(delta)
+    affected = []
+    for delta in deltas:
+        affected.append(tuple(sorted({w for index, change in enumerate(delta) if change for w in watchers[index]})))
+    return [tuple(recipes) for recipes in watchers], affected
+
+
+def make_incremental_graph(recipes, affected):
+    # A drop-in replacement for graph(state) that works out a state's applicable recipes
+    # from its parent's instead of checking every recipe: the parent's set, minus and
+    # re-checked for affected[r] of the recipe r that made it. Each successor remembers its
+    # parent's set (as a bitmask) and r until it is expanded, or until the search calls
+    # forget(successor) because it won't be (a duplicate, or pruned); states reached any other
+    # way (the start, or one expanded twice) get a full check. Pays off once recipe files have
+    # hundreds of recipes and each only touches a few items.
+    checks = [recipe.check for recipe in recipes]
+    everything = (1 << len(recipes)) - 1
+    keep = [everything ^ sum(1 << a for a in rs) for rs in affected]
+    pending = {}  # successor -> (parent's applicable mask, recipe that made it)
+
+    def incremental_graph(state):
+        origin = pending.pop(state, None)
+        if origin is None:
+            mask = 0
+            for r, check in enumerate(checks):
+                if check(state):
+                    mask |= 1 << r
+        else:
+            mask, fired = origin
+            mask &= keep[fired]
+            for a in affected[fired]:
+                if checks[a](state):
+                    mask |= 1 << a
+        left = mask
+        while left:
+            low = left & -left
+            left ^= low
+            r = low.bit_length() - 1
+            recipe = recipes[r]
+            new_state = recipe.effect(state)
+            pending[new_state] = (mask, r)
+            yield (recipe.name, new_state, recipe.cost)
+
+    def forget(state):
+        pending.pop(state, None)
+
+    incremental_graph.pending = pending  # (clear it to free the memory between searches)
+    incremental_graph.forget = forget
+    return incremental_graph
+
+
+def generate_domain_source(crafting):
+    # Writes the source of a module holding the parsed crafting file and one straight-line
+    # check/effect function per recipe: fixed index comparisons and a tuple literal for the
+    # new state, with no dict lookups or loops left at call time.
+    item_index = {item: index for index, item in enumerate(crafting['Items'])}
+    lines = ['# Generated by craft_planner.py from a crafting file, do not edit.',
+             'Crafting = ' + repr(crafting),
+             '']
+    recipes = []
+    for r, (name, rule) in enumerate(crafting['Recipes'].items()):
+        need, delta = rule_vectors(rule, item_index)
+        tests = ['s[%d] >= %d' % (index, amount) for index, amount in enumerate(need) if amount > 0]
+        parts = ['s[%d]' % index if change == 0 else 's[%d] %+d' % (index, change)
+                 for index, change in enumerate(delta)]
+        lines.append('')
+        lines.append('def check_%d(s):' % r)
+        lines.append('    return ' + (' and '.join(tests) if tests else 'True'))
+        lines.append('')
+        lines.append('def effect_%d(s):' % r)
+        lines.append('    return (' + ', '.join(parts) + ',)')
+        recipes.append('    (%r, check_%d, effect_%d, %r),' % (name, r, r, rule['Time']))
+    lines.append('')
+    lines.append('RECIPES = [')
+    lines.extend(recipes)
+    lines.append(']')
+    watchers, affected = index_recipes(crafting, item_index)
+    lines.append('')
+    lines.append('# Recipes whose preconditions mention each item, and that each recipe can change')
+    lines.append('WATCHERS = ' + repr(watchers))
+    lines.append('AFFECTED = ' + repr(affected))
+    return '\n'.join(lines) + '\n'
+
+
+# Bumped whenever generate_domain_source changes, so older cached modules aren't loaded
+DOMAIN_FORMAT = 2
+
+
+def write_atomically(path, data):
+    # Write to a temporary name first so a concurrent run never sees half a file
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+def domain_key(raw):
+    # Names a crafting file by a hash of its bytes: the compiled-domain cache's key, and what
+    # tells SubplanCache's plans for different files apart
+    return 'domain%d_%s' % (DOMAIN_FORMAT, hashlib.sha256(raw).hexdigest()[:20])
+
+
+def load_compiled_domain(path, cache_dir):
+    # Loads the generated module for a crafting file, keyed by a hash of the file's bytes.
+    # The module is only generated (and the JSON only parsed) the first time a file is seen;
+    # after that its code object is read straight back with marshal, so repeat runs skip
+    # both json.load and compiling. The .py is kept next to it for reading/debugging.
+    with open(path, 'rb') as f:
+        raw = f.read()
+    key = domain_key(raw)
+    source_path = os.path.join(cache_dir, key + '.py')
+    code_path = os.path.join(cache_dir, '%s.%s.code' % (key, sys.implementation.cache_tag))
+    try:
+        with open(code_path, 'rb') as f:
+            code = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        source = generate_domain_source(json.loads(raw))
+        code = compile(source, source_path, 'exec')
+        os.makedirs(cache_dir, exist_ok=True)
+        write_atomically(source_path, source.encode())
+        write_atomically(code_path, marshal.dumps(code))
+    domain = types.ModuleType(key)
+    exec(code, domain.__dict__)
+    return domain
+
+
+def plan_key(crafting):
+    # What a plan depends on: the recipes, the initial inventory and the goal (not the order
+    # of Items, since plans are kept as recipe names)
+    problem = json.dumps([crafting['Recipes'], crafting['Initial'], crafting['Goal']], sort_keys=True)
+    return 'plan_' + hashlib.sha256(problem.encode()).hexdigest()[:20]
+
+
+def load_cached_plan(cache_dir, key):
+    # The cached {'actions', 'cost', 'optimal', 'modes'} for a plan_key, or None, where modes
+    # lists the search settings known to find no better plan. A hit counts as a use for
+    # store_plan's eviction.
+    path = os.path.join(cache_dir, key + '.json')
+    try:
+        with open(path) as f:
+            plan = json.load(f)
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return plan
+
+
+def store_plan(cache_dir, key, actions, cost, optimal, modes, max_plans=256):
+    # Saves a plan under its plan_key, then drops the least recently used plans past max_plans
+    os.makedirs(cache_dir, exist_ok=True)
+    plan = {'actions': actions, 'cost': cost, 'optimal': optimal, 'modes': modes}
+    write_atomically(os.path.join(cache_dir, key + '.json'), json.dumps(plan).encode())
+    plans = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+             if name.startswith('plan_') and name.endswith('.json')]
+    if len(plans) > max_plans:
+        plans.sort(key=lambda path: os.stat(path).st_mtime)
+        for path in plans[:len(plans) - max_plans]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # another run got there first
+
+
+def derive_macros(crafting, max_repeat=8):
+    # Macro-actions: fixed sequences of recipes searched as one step. Two kinds come out of
+    # the recipe file:
+    # - chains: an item only one recipe eats (and the goal doesn't ask for) is only ever made
+    #   for that recipe, so gathering exactly what it needs and then firing it is one macro,
+    #   e.g. "punch for wood, craft plank" or "iron_pickaxe for ore, stone_pickaxe for coal,
+    #   smelt ore in furnace"
+    # - repeats: gathering recipes (that eat nothing) run 2, 4, ... max_repeat times in a row
+    # The primitive recipes stay available, so no plan is lost and costs stay optimal.
+    # Returns a dict of macro name -> list of recipe names.
+    recipes = crafting['Recipes']
+    producers = defaultdict(list)
+    consumers = defaultdict(list)
+    for name, rule in recipes.items():
+        for item in rule['Produces']:
+            producers[item].append(name)
+        for item in rule.get('Consumes', {}):
+            consumers[item].append(name)
+
+    macros = {}
+    for name, rule in recipes.items():
+        consumed = rule.get('Consumes', {})
+        if not consumed or any(item in crafting['Goal'] or consumers[item] != [name] for item in consumed):
+            continue
+        options = [[]]
+        for item, amount in consumed.items():
+            choices = []
+            for producer in producers[item]:
+                made = recipes[producer]['Produces'][item]
+                if not recipes[producer].get('Consumes') and amount % made == 0:
+                    choices.append([producer] * (amount // made))
+            options = [steps + choice for steps in options for choice in choices]
+        for steps in options:
+            steps.append(name)
+            macros[', '.join(steps)] = steps
+
+    for name, rule in recipes.items():
+        if rule.get('Consumes'):
+            continue
+        repeat = 2
+        while repeat <= max_repeat:
+            macros['%s x%d' % (name, repeat)] = [name] * repeat
+            repeat *= 2
+    return macros
+
+
+def make_macro_graph(graph, recipes, macros, heuristic=None):
+    # Wraps a graph so it also yields every macro whose steps can all be fired in turn, as one
+    # successor costing the sum of the steps. If a heuristic is given, macros it would prune at
+    # any step are left out here: search records a pruned state's cost, and a macro pruned
+    # halfway would otherwise block the same state being reached one recipe at a time
+    by_name = {recipe.name: recipe for recipe in recipes}
+    steps_of = [(name, [by_name[step] for step in steps]) for name, steps in macros.items()]
 
+    def macro_graph(state):
+        yield from graph(state)
+        for name, steps in steps_of:
+            new_state = state
+            cost = 0
+            for recipe in steps:
+                if not recipe.check(new_state):
+                    break
+                new_state = recipe.effect(new_state)
+                cost += recipe.cost
+                if heuristic is not None and heuristic(new_state, recipe.name) == inf:
+                    break
+            else:
+                yield (name, new_state, cost)
 
-        #No recipie needs more than 2 sticks, so if we have more than 4 (1 craft worth) something is bad
-        if (state["stick"]) > (4 if "stick" not in Crafting['Goal'] else max(4, ceil(Crafting["Goal"]["stick"]/4) * 4)):
+    return macro_graph
+
+
+def macro_steps(state, steps, deltas):
+    # Given the state after a macro, works back to the state after each of its steps
+    # and returns [(state after step, step name)] in order
+    walked = []
+    for step in reversed(steps):
+        walked.append((state, step))
+        state = tuple(count - change for count, change in zip(state, deltas[step]))
+    walked.reverse()
+    return walked
+
+
+def make_macro_heuristic(heuristic, macros):
+    # Scores a macro as its last step, since the heuristic rules are written per recipe
+    def macro_heuristic(state, action_name):
+        steps = macros.get(action_name)
+        return heuristic(state, steps[-1] if steps else action_name)
+
+    return macro_heuristic
+
+
+def expand_macros(plan, crafting, item_index, macros):
+    # Turns the macro steps of a finished plan back into the primitive (state, action) steps
+    deltas = {name: rule_vectors(rule, item_index)[1] for name, rule in crafting['Recipes'].items()}
+    expanded = []
+    for state, action in plan:
+        if action in macros:
+            expanded.extend(macro_steps(state, macros[action], deltas))
+        else:
+            expanded.append((state, action))
+    return expanded
+
+
+def make_prune_heuristic(crafting, item_index):
+    # The hand-written pruning heuristic. It names the items of the bundled crafting.json
+    # (wood, plank, ... iron_axe) directly, and takes the goal from crafting.
+    def heuristic(state, action_name):
+        # Implement your heuristic here!
+        #You should never have more than 1 wood, unless the objective is for it, should be turning it into planks instead
+        if state[item_index["wood"]] > (1 if "wood" not in crafting['Goal'] else max(crafting["Goal"]["wood"], 1)):
+            return inf
+        #If you have wood, you should be turning it into planks, if you're not trying to gather it
+        if "wood" not in crafting['Goal'] and  state[item_index["wood"]] == 1 and "for wood" not in action_name:
             return inf
-#
-        #Don't need more planks than 1 craft makes, except that due to reasons you might need more temporarily
-        if state["plank"] > (7 if "plank" not in Crafting['Goal'] else max(7, ceil(Crafting["Goal"]["plank"]/4) * 4)):
+
+        #Don't need more than 8 cobble
+        if state[item_index["cobble"]] > (8 if "cobble" not in crafting['Goal'] else max(8, crafting["Goal"]["cobble"])):
             return inf
-        #If you have enough planks to make sticks, and you have made everything needing planks, and planks aren't a goal, make sticks instead
-        if "plank" not in Crafting["Goal"] and state["bench"] and state["wooden_pickaxe"] and state["wooden_axe"] and state["plank"] > 3 and action_name != "craft plank" and action_name != "craft stick":
+
+        #never need more than 6 ingot since max ingot to craft is 6 with the rails
+        if state[item_index["ingot"]] > (6 if "ingot" not in crafting['Goal'] else max(6, crafting["Goal"]["ingot"])):
             return inf
-        #check these only for benchcrafting
-        if action_name[-8:] == "at bench":
-            #Get shortened name
-            shortened_name = action_name[6:-9]
-            #Don't make worse pickaxes or axes
-            if shortened_name == "wooden_axe" and state["stone_axe"]:
-                #print("failaxe")
-                return inf
-            if (shortened_name == "stone_axe" or shortened_name == "wooden_axe") and state["iron_axe"]:
-                #print("failaxe")
+
+        #seems like we only need 1 cart for now subject to change
+        if state[item_index["cart"]] > (1 if "cart" not in crafting['Goal'] else crafting["Goal"]["cart"]):
+            return inf
+
+        #Only check these requirements if you're crafting
+        if action_name[0:5] == "craft":
+            #Don't make duplicate tools
+            list_of_tools = ["bench", "furnace", "wooden_pickaxe", "stone_pickaxe", "iron_pickaxe", "wooden_axe", "stone_axe", "iron_axe"]
+            for tool in list_of_tools:
+                if state[item_index[tool]] > 1:
+                    return inf
+
+
+            #No recipie needs more than 2 sticks, so if we have more than 4 (1 craft worth) something is bad
+            if (state[item_index["stick"]]) > (4 if "stick" not in crafting['Goal'] else max(4, ceil(crafting["Goal"]["stick"]/4) * 4)):
                 return inf
-            if shortened_name == "wooden_pickaxe" and state["stone_pickaxe"]:
-                #print("failpick")
+    #
+            #Don't need more planks than 1 craft makes, except that due to reasons you might need more temporarily
+            if state[item_index["plank"]] > (7 if "plank" not in crafting['Goal'] else max(7, ceil(crafting["Goal"]["plank"]/4) * 4)):
                 return inf
-            if (shortened_name == "stone_pickaxe" or shortened_name == "wooden_pickaxe") and state["iron_pickaxe"]:
-                #print("failpick")
+            #If you have enough planks to make sticks, and you have made everything needing planks, and planks aren't a goal, make sticks instead
+            if "plank" not in crafting["Goal"] and state[item_index["bench"]] and state[item_index["wooden_pickaxe"]] and state[item_index["wooden_axe"]] and state[item_index["plank"]] > 3 and action_name != "craft plank" and action_name != "craft stick":
                 return inf
-            #At this point, if we're making a tool, priortiise it, tools are good)
-        #    if "axe" in shortened_name:
-            #    return -.5
-
-    #Check to see that you never use a bad tool, or that you make a better tool instead of using a bad one
-    elif "axe" in action_name:
-        #check pickaxes
-        if "pickaxe" in action_name:
-            #The first "iron_pickaxe" in the next line should be stone instead, but this makes a better runtime
-            if ("wooden_pickaxe" in action_name or "stone_pickaxe" in action_name) and (state["iron_pickaxe"] or (state["ingot"] >= 3 and state["stick"] >= 2)):
+            #check these only for benchcrafting
+            if action_name[-8:] == "at bench":
+                #Get shortened name
+                shortened_name = action_name[6:-9]
+                #Don't make worse pickaxes or axes
+                if shortened_name == "wooden_axe" and state[item_index["stone_axe"]]:
+                    return inf
+                if (shortened_name == "stone_axe" or shortened_name == "wooden_axe") and state[item_index["iron_axe"]]:
+                    return inf
+                if shortened_name == "wooden_pickaxe" and state[item_index["stone_pickaxe"]]:
+                    return inf
+                if (shortened_name == "stone_pickaxe" or shortened_name == "wooden_pickaxe") and state[item_index["iron_pickaxe"]]:
+                    return inf
+                #At this point, if we're making a tool, priortiise it, tools are good)
+            #    if "axe" in shortened_name:
+                #    return -.5
+
+        #Check to see that you never use a bad tool, or that you make a better tool instead of using a bad one
+        elif "axe" in action_name:
+            #check pickaxes
+            if "pickaxe" in action_name:
+                #The first "iron_pickaxe" in the next line should be stone instead, but this makes a better runtime
+                if ("wooden_pickaxe" in action_name or "stone_pickaxe" in action_name) and (state[item_index["iron_pickaxe"]] or (state[item_index["ingot"]] >= 3 and state[item_index["stick"]] >= 2)):
+                    return inf
+                if "wooden_pickaxe" in action_name and (state[item_index["stone_pickaxe"]] or (state[item_index["cobble"]] > 3 and state[item_index["stick"]] >= 2)):
+                    return inf
+
+                #Also make sure we aren't trying to get cobble if we already have everything that needs cobble
+                if "cobble" in action_name and state[item_index["furnace"]] and (state[item_index["stone_pickaxe"]] or state[item_index["iron_pickaxe"]]) and (state[item_index["stone_axe"]] or state[item_index["iron_axe"]]):
+                    return inf
+            #check axes
+            else:
+                if ("wooden_axe" in action_name or "stone_axe" in action_name) and (state[item_index["iron_axe"]] or (state[item_index["ingot"]] >= 3 and state[item_index["stick"]] >= 2)):
+                    return inf
+                if "wooden_axe" in action_name and (state[item_index["stone_axe"]] or (state[item_index["cobble"]] >= 3 and state[item_index["stick"]] >= 2)):
+                    return inf
+
+        #Only run these checks if we aren't trying to gather coal or ore
+        if "coal" not in crafting["Goal"] and "ore" not in crafting["Goal"]:
+            #If we have no ore, don't get coal
+            if state[item_index["ore"]] == 0 and state[item_index["coal"]] > 0:
                 return inf
-            if "wooden_pickaxe" in action_name and (state["stone_pickaxe"] or (state["cobble"] > 3 and state["stick"] >= 2)):
+
+            #Check to see that if we can smelt ore, we are doing so
+            #Essentially if we're doing anything else, don't do it
+            if state[item_index["ore"]] == 1 and "for coal" not in action_name and state[item_index["furnace"]] and state[item_index["coal"]] == 1 and "craft furnace" not in action_name:
                 return inf
+        #If we have ore, don't get more ore, smelt it instead
+        if state[item_index["ore"]] > (1 if "ore" not in crafting['Goal'] else crafting["Goal"]["ore"]):
+            return inf
+        #If we have coal, don't get more coal, use it for smelting:
+        if state[item_index["coal"]] > (1 if "coal" not in crafting['Goal'] else crafting["Goal"]["coal"]):
+            return inf
+        #If we're smelting, always do this (if we weren't going to smelt we shouldn't have mined)
+        if action_name == "smelt ore in furnace":
+            return -inf
+        return 0
+
+    return heuristic
+
+
+def compute_caps(crafting, item_index):
+    # Works out, from the recipe file alone, the most of every item that can ever be useful
+    # to hold at once. Tools (required, never consumed) are capped at one, or the goal amount,
+    # plus one batch short of the biggest batch they're made in (a bench made two at a time
+    # still has to be made). Anything else is capped at what the goal wants plus the most any single recipe eats, plus
+    # one batch short of the biggest batch it's made in (e.g. 3 planks left, craft 4 more).
+    # An item nothing consumes or requires is only worth making for the goal.
+    tools = set(find_tools(crafting))
+    need = defaultdict(int)
+    batch = defaultdict(int)
+    for rule in crafting['Recipes'].values():
+        for item, condition in rule.get('Requires', {}).items():
+            need[item] = max(need[item], 1 if condition else 0)
+        for item, amount in rule.get('Consumes', {}).items():
+            need[item] = max(need[item], amount)
+        for item, amount in rule['Produces'].items():
+            batch[item] = max(batch[item], amount)
+
+    caps = [0] * len(item_index)
+    for item, i in item_index.items():
+        goal = crafting['Goal'].get(item, 0)
+        if item in tools:
+            caps[i] = max(goal, 1) + max(batch[item] - 1, 0)
+        elif goal or need[item]:
+            caps[i] = goal + need[item] + max(batch[item] - 1, 0)
+        # else: nothing ever needs it, so holding any is a waste
+    return caps
+
+
+def find_better_recipes(crafting):
+    # For every recipe, the Requires sets of other recipes that make at least as much of
+    # everything, eat no more of anything and take no longer. Whenever one of those sets is
+    # held the better recipe could have been used instead (e.g. stone_pickaxe for cobble
+    # instead of wooden_pickaxe for cobble). Exact ties keep the first recipe in the file.
+    recipes = list(crafting['Recipes'].items())
+
+    def at_least_as_good(better, worse):
+        return (all(better['Produces'].get(item, 0) >= amount for item, amount in worse['Produces'].items())
+                and all(worse.get('Consumes', {}).get(item, 0) >= amount
+                        for item, amount in better.get('Consumes', {}).items())
+                and better['Time'] <= worse['Time'])
 
-            #Also make sure we aren't trying to get cobble if we already have everything that needs cobble
-            if "cobble" in action_name and state["furnace"] and (state["stone_pickaxe"] or state["iron_pickaxe"]) and (state["stone_axe"] or state["iron_axe"]):
+    betters = {}
+    for n, (name, rule) in enumerate(recipes):
+        betters[name] = []
+        for m, (other_name, other) in enumerate(recipes):
+            if m == n or not at_least_as_good(other, rule):
+                continue
+            if at_least_as_good(rule, other) and n < m:
+                continue
+            betters[name].append(tuple(item for item, condition in other.get('Requires', {}).items() if condition))
+    return betters
+
+
+def find_dominated_tools(crafting, betters):
+    # Tool a is dominated by tool b if every recipe needing a has a better recipe that only
+    # needs b (plus whatever else the first one needed). Making a while holding b is a waste.
+    tools = find_tools(crafting)
+    dominated = defaultdict(list)
+    for a in tools:
+        users = [(name, rule) for name, rule in crafting['Recipes'].items() if a in rule.get('Requires', {})]
+        if not users:
+            continue
+        for b in tools:
+            if b != a and all(any(b in better and set(better) - {b} <= set(rule.get('Requires', {}))
+                                  for better in betters[name])
+                              for name, rule in users):
+                dominated[a].append(b)
+    return dominated
+
+
+def find_commuting_actions(crafting):
+    # Partial-order reduction. Two recipes are independent if neither changes an item the other
+    # needs or changes, and neither makes a tool: then either order works from the same state
+    # and ends in the same state, at the same cost. So we only ever fire such a pair in file
+    # order, and after recipe a never fire an independent recipe that comes before it in the
+    # file. Any plan can be reordered that way, so no cheapest plan is lost.
+    # Returns, for every recipe, the set of recipes to skip right after it.
+    tools = set(find_tools(crafting))
+    recipes = list(crafting['Recipes'].items())
+    needs = {}
+    changes = {}
+    for name, rule in recipes:
+        needs[name] = set(item for item, condition in rule.get('Requires', {}).items() if condition)
+        needs[name].update(rule.get('Consumes', {}))
+        produced = set(rule['Produces'])
+        consumed = set(rule.get('Consumes', {}))
+        # Items both eaten and made in equal amounts don't change, but be safe and count them
+        changes[name] = produced | consumed
+
+    def independent(a, b):
+        if tools & (set(crafting['Recipes'][a]['Produces']) | set(crafting['Recipes'][b]['Produces'])):
+            return False
+        return not (changes[a] & (needs[b] | changes[b])) and not (changes[b] & needs[a])
+
+    skip_after = {}
+    for n, (name, _) in enumerate(recipes):
+        skip_after[name] = frozenset(other for other, _ in recipes[:n] if independent(name, other))
+    return skip_after
+
+
+def make_cap_heuristic(crafting, item_index, estimate=None):
+    # Returns a pruning heuristic built only from the structure of the recipe file: inf for any
+    # state holding more of an item than compute_caps allows, for using a recipe when a better
+    # one was available, or for making a tool when a tool that dominates it is already held.
+    # Otherwise it returns estimate(state, action_name), or 0 without one.
+    # All of this is worked out per action up front, so each call only checks the items that
+    # action can have pushed over their cap.
+    caps = compute_caps(crafting, item_index)
+    betters = find_better_recipes(crafting)
+    dominated = find_dominated_tools(crafting, betters)
+
+    limits = {}
+    for name, rule in crafting['Recipes'].items():
+        checks = tuple((item_index[item], caps[item_index[item]]) for item in rule['Produces'])
+        held = [tuple(item_index[item] for item in better) for better in betters[name]]
+        for item in rule['Produces']:
+            if item not in crafting['Goal']:
+                held.extend((item_index[better],) for better in dominated[item])
+        limits[name] = (checks, tuple(held))
+
+    def cap_heuristic(state, action_name):
+        checks, held = limits.get(action_name, ((), ()))
+        for i, cap in checks:
+            if state[i] > cap:
                 return inf
-        #check axes
-        else:
-            if ("wooden_axe" in action_name or "stone_axe" in action_name) and (state["iron_axe"] or (state["ingot"] >= 3 and state["stick"] >= 2)):
+        for required in held:
+            for i in required:
+                if not state[i]:
+                    break
+            else:
                 return inf
-            if "wooden_axe" in action_name and (state["stone_axe"] or (state["cobble"] >= 3 and state["stick"] >= 2)):
+        return estimate(state, action_name) if estimate else 0
+
+    return cap_heuristic
+
+
+def find_tools(crafting):
+    # Items some recipe Requires but no recipe Consumes: once you have one you keep it
+    required = set()
+    consumed = set()
+    for rule in crafting['Recipes'].values():
+        required.update(rule.get('Requires', {}))
+        consumed.update(rule.get('Consumes', {}))
+    return [item for item in crafting['Items'] if item in required and item not in consumed]
+
+
+def compute_item_values(crafting, item_index, recipe_names):
+    # Works out a per-unit "value" u[i] for every item: the cheapest cost of making one of it
+    # from nothing using only the given recipes, ignoring ordering, with a recipe's cost (plus
+    # what it eats) shared evenly between the things it produces. The values are chosen so
+    # that none of those recipes gains more value than its Time, i.e.
+    # sum(delta[i] * u[i]) <= cost, which is what makes the bound below admissible.
+    # Also returns the set of item indices the recipes can produce at all.
+    rules = []
+    for name in recipe_names:
+        rule = crafting['Recipes'][name]
+        need, delta = rule_vectors(rule, item_index)
+        consumed = [(i, -change) for i, change in enumerate(delta) if change < 0]
+        produced = [(i, change) for i, change in enumerate(delta) if change > 0]
+        if produced:
+            rules.append((rule['Time'], consumed, produced, delta))
+
+    values = [inf] * len(item_index)
+    producible = set(i for _, _, produced, _ in rules for i, _ in produced)
+    for i in range(len(values)):
+        if i not in producible:
+            # Can only ever be used up, so it's worth nothing towards the bound
+            values[i] = 0
+
+    # Bellman-Ford style relaxation. Recipe graphs are almost always acyclic, so this settles
+    # in a handful of rounds; the cap is only there for odd files with production loops.
+    for _ in range(len(values) + 1):
+        changed = False
+        for cost, consumed, produced, _ in rules:
+            inputs = cost + sum(amount * values[i] for i, amount in consumed)
+            if inputs == inf:
+                continue
+            share = inputs / len(produced)
+            for i, amount in produced:
+                if share / amount < values[i] - 1e-12:
+                    values[i] = share / amount
+                    changed = True
+        if not changed:
+            break
+    # Anything still inf needs an input these recipes can never make
+    producible = set(i for i in producible if values[i] != inf)
+    values = [0 if value == inf else value for value in values]
+
+    # If the relaxation was cut short some recipe may still gain more value than it costs,
+    # so scale every value down until none does.
+    scale = 1
+    for cost, _, _, delta in rules:
+        gain = sum(map(mul, delta, values))
+        if gain > cost:
+            scale = min(scale, cost / gain)
+    return [value * scale for value in values], producible
+
+
+def find_producible(crafting, item_index, recipe_names):
+    # Item indices the given recipes can make starting from nothing at all
+    producible = set()
+    changed = True
+    while changed:
+        changed = False
+        for name in recipe_names:
+            rule = crafting['Recipes'][name]
+            if all(item_index[item] in producible for item in rule.get('Consumes', {})):
+                for item in rule['Produces']:
+                    if item_index[item] not in producible:
+                        producible.add(item_index[item])
+                        changed = True
+    return producible
+
+
+# Past this many tools the bound stops telling tool sets apart (2 ** tools value tables)
+MAX_BOUND_TOOLS = 12
+
+
+def make_bound_heuristic(crafting, item_index):
+    # Returns an admissible (and consistent) heuristic: a lower bound on the cost still needed
+    # to reach the goal. Say a plan from state s ends in state f holding the tool set T. Every
+    # recipe it fires only needs tools from T, and none of those recipes adds more value than
+    # its Time, so the plan costs at least sum(u_T[i] * (f[i] - s[i])), which is at least
+    # sum(u_T[i] * (goal_T[i] - s[i])) where goal_T also asks for one of every tool in T.
+    # T isn't known, so we take the smallest bound over every tool set containing the tools
+    # s already holds. This is the dual of the LP over how many times each recipe fires.
+    tools = find_tools(crafting)
+    if len(tools) > MAX_BOUND_TOOLS:
+        tools = []
+    tool_bits = tuple((1 << bit, item_index[tool]) for bit, tool in enumerate(tools))
+
+    goal = [0] * len(item_index)
+    for item, amount in crafting['Goal'].items():
+        goal[item_index[item]] = amount
+
+    # With whole-number costs the remaining cost is whole too, so the bound can be rounded up
+    whole = all(float(rule['Time']).is_integer() for rule in crafting['Recipes'].values())
+
+    def table(recipe_names, goal_t):
+        # (value of goal_T, u_T, goal amounts these recipes can't produce at all)
+        values, producible = compute_item_values(crafting, item_index, recipe_names)
+        fixed = tuple((i, amount) for i, amount in enumerate(goal_t) if amount > 0 and i not in producible)
+        return sum(map(mul, values, goal_t)), tuple(values), fixed
+
+    # Every tool set T gets two tables. The loose one uses every recipe T allows. The tight one
+    # also drops recipes eating items T can never make (the "blockers"), so it only holds for
+    # states that have none of those items; for them it is usually much closer to the truth.
+    options = []
+    for mask in range(1 << len(tools)):
+        held = set(tool for bit, tool in enumerate(tools) if mask >> bit & 1)
+        usable = [name for name, rule in crafting['Recipes'].items()
+                  if all(item in held for item in rule.get('Requires', {}) if item in tools)]
+        producible = find_producible(crafting, item_index, usable)
+        reachable = [name for name in usable
+                     if all(item_index[item] in producible for item in crafting['Recipes'][name].get('Consumes', {}))]
+        blockers = tuple(i for i in range(len(item_index)) if i not in producible)
+        goal_t = list(goal)
+        for tool in held:
+            goal_t[item_index[tool]] = max(goal_t[item_index[tool]], 1)
+        # Tools in T that T can't make itself (these need to be held already)
+        missing = sum(bit for bit, i in tool_bits if i not in producible)
+        options.append((missing, table(reachable, goal_t), blockers, table(usable, goal_t)))
+
+    def dominates(x, y):
+        # True if table x never gives a bigger bound than table y on any state
+        return x[0] <= y[0] and all(a >= b for a, b in zip(x[1], y[1])) and set(x[2]) <= set(y[2])
+
+    def never_better(a, b):
+        # True if option a never gives a smaller bound than option b. Whenever a can use its
+        # tight table b can too, and a's loose table is no better than either of b's.
+        return (set(b[1]) <= set(a[1]) and dominates(b[0], a[0]) and dominates(b[2], a[2])
+                and dominates(b[0], a[2]))
+
+    candidates = {}
+
+    def candidates_for(held):
+        # Tool sets containing the held ones whose other tools can actually be made, minus any
+        # option another one always beats
+        kept = [(tight, blockers, loose) for mask, (missing, tight, blockers, loose) in enumerate(options)
+                if mask & held == held and not missing & mask & ~held]
+        kept = list(dict.fromkeys(kept))
+        candidates[held] = [a for n, a in enumerate(kept)
+                            if not any(never_better(a, b) and (n < m or not never_better(b, a))
+                                       for m, b in enumerate(kept) if m != n)]
+        return candidates[held]
+
+    def estimate(option, state):
+        target, values, fixed = option
+        for i, amount in fixed:
+            if state[i] < amount:
                 return inf
+        return target - sum(map(mul, values, state))
 
-    #Only run these checks if we aren't trying to gather coal or ore
-    if "coal" not in Crafting["Goal"] and "ore" not in Crafting["Goal"]:
-        #If we have no ore, don't get coal
-        if state["ore"] == 0 and state["coal"] > 0:
+    def bound_heuristic(state, action_name):
+        held = 0
+        for bit, i in tool_bits:
+            if state[i]:
+                held |= bit
+        options = candidates.get(held)
+        if options is None:
+            options = candidates_for(held)
+        best = inf
+        for tight, blockers, loose in options:
+            for i in blockers:
+                if state[i]:
+                    bound = estimate(loose, state)
+                    break
+            else:
+                bound = estimate(tight, state)
+            if bound < best:
+                best = bound
+        if best == inf:
             return inf
+        if best <= 0:
+            return 0
+        return ceil(best - 1e-9) if whole else best
 
-        #Check to see that if we can smelt ore, we are doing so
-        #Essentially if we're doing anything else, don't do it
-        if state["ore"] == 1 and "for coal" not in action_name and state["furnace"] and state["coal"] == 1 and "craft furnace" not in action_name:
-            return inf
-    #If we have ore, don't get more ore, smelt it instead
-    if state["ore"] > (1 if "ore" not in Crafting['Goal'] else Crafting["Goal"]["ore"]):
-        return inf
-    #If we have coal, don't get more coal, use it for smelting:
-    if state["coal"] > (1 if "coal" not in Crafting['Goal'] else Crafting["Goal"]["coal"]):
-        return inf
-    #If we're smelting, always do this (if we weren't going to smelt we shouldn't have mined)
-    if action_name == "smelt ore in furnace":
-        return -inf
-    #print (action_name + " returned 0")
-    return 0
-
-def search(graph, state, is_goal, limit, heuristic):
+    return bound_heuristic
+
+
+# Most abstract states one pattern database may have (they take a few seconds per 100,000 to build)
+PDB_MAX_SIZE = 100000
+
+
+def abstraction_caps(crafting, item_index):
+    # The count past which a pattern database stops telling amounts of an item apart: the
+    # most any recipe needs, or the goal wants, whichever is more (0 for items nothing needs)
+    caps = [0] * len(item_index)
+    for rule in crafting['Recipes'].values():
+        need, _ = rule_vectors(rule, item_index)
+        caps = list(map(max, caps, need))
+    for item, amount in crafting['Goal'].items():
+        caps[item_index[item]] = max(caps[item_index[item]], amount)
+    return caps
+
+
+def choose_patterns(crafting, item_index, caps, max_size=PDB_MAX_SIZE):
+    # Picks the item sets to build pattern databases over: one per goal item not already in an
+    # earlier pattern, grown from the goal item through what its recipes consume and require
+    # (nearest first) for as long as the abstract state count, the product of cap + 1 over
+    # the pattern, stays within max_size.
+    inputs = defaultdict(list)
+    for rule in crafting['Recipes'].values():
+        for item in rule['Produces']:
+            inputs[item].extend(i for i in list(rule.get('Consumes', {})) + list(rule.get('Requires', {}))
+                                if i not in inputs[item])
+    patterns = []
+    for item in crafting['Goal']:
+        if any(item_index[item] in pattern for pattern in patterns):
+            continue
+        pattern = [item_index[item]]
+        size = caps[item_index[item]] + 1
+        queue = list(inputs[item])
+        for other in queue:
+            i = item_index[other]
+            if i in pattern or not caps[i] or size * (caps[i] + 1) > max_size:
+                continue
+            pattern.append(i)
+            size *= caps[i] + 1
+            queue.extend(more for more in inputs[other] if more not in queue)
+        patterns.append(tuple(sorted(pattern)))
+    return patterns
+
+
+def build_pattern_database(crafting, item_index, pattern, caps):
+    # Exact costs to the goal in the projection of the domain onto the items in pattern, with
+    # each count topped out at its cap (the top value standing for "cap or more"). A recipe
+    # fires from a top value whatever it needs, and consuming from it can leave anything from
+    # cap - amount up to cap, so every real plan still maps onto an abstract one that costs
+    # the same and the costs are admissible. Solved with Dijkstra backwards from the goal
+    # states. Returns the costs as a flat list in mixed radix order (last item fastest), inf
+    # where the goal can't be reached.
+    pattern_caps = [caps[i] for i in pattern]
+    strides = [1] * len(pattern)
+    for j in range(len(pattern) - 2, -1, -1):
+        strides[j] = strides[j + 1] * (pattern_caps[j + 1] + 1)
+    size = strides[0] * (pattern_caps[0] + 1)
+
+    # Each recipe as (cost, [(position, need, change)]) over the pattern items it touches
+    abstract = []
+    for rule in crafting['Recipes'].values():
+        need, delta = rule_vectors(rule, item_index)
+        if not any(delta[i] for i in pattern):
+            continue
+        touched = [(j, need[i], delta[i]) for j, i in enumerate(pattern) if need[i] or delta[i]]
+        abstract.append((rule['Time'], touched))
+
+    costs = [inf] * size
+    frontier = []
+    goal = [crafting['Goal'].get(item, 0) for item in crafting['Items']]
+    for digits in product(*[range(min(goal[i], cap), cap + 1) for i, cap in zip(pattern, pattern_caps)]):
+        index = sum(map(mul, digits, strides))
+        costs[index] = 0
+        frontier.append((0, index))
+
+    while frontier:
+        cost, index = heappop(frontier)
+        if cost > costs[index]:
+            continue
+        digits = [index // stride % (cap + 1) for stride, cap in zip(strides, pattern_caps)]
+        for time_cost, touched in abstract:
+            # Every abstract state this recipe takes to digits, one position at a time
+            choices = []
+            for j, least, change in touched:
+                value, cap = digits[j], pattern_caps[j]
+                if change == 0:
+                    before = [value] if value >= least else []
+                elif value < cap:
+                    before = [value - change] if least <= value - change < cap else []
+                    if change < 0 and value >= cap + change:
+                        before.append(cap)
+                else:
+                    before = range(max(cap - change, least, 0), cap + 1) if change > 0 else [cap]
+                if not before:
+                    break
+                choices.append([(value_before - value) * strides[j] for value_before in before])
+            else:
+                new_cost = cost + time_cost
+                for shifts in product(*choices):
+                    earlier = index + sum(shifts)
+                    if new_cost < costs[earlier]:
+                        costs[earlier] = new_cost
+                        heappush(frontier, (new_cost, earlier))
+    return costs
+
+
+def pattern_database_key(crafting, pattern, caps):
+    # What a pattern database depends on: the recipes, the goal on the pattern's items, and
+    # the pattern and its caps
+    items = [crafting['Items'][i] for i in pattern]
+    data = json.dumps([crafting['Recipes'], {item: crafting['Goal'].get(item, 0) for item in items}, items,
+                       [caps[i] for i in pattern]], sort_keys=True)
+    return 'pdb_' + hashlib.sha256(data.encode()).hexdigest()[:20]
+
+
+def store_pattern_database(cache_dir, key, costs, whole):
+    # Saves the costs as a flat array of the smallest type that holds them (its largest value
+    # standing for inf), with a small JSON file saying which, so it can be memory-mapped back
+    finite = [cost for cost in costs if cost != inf]
+    if whole and max(finite, default=0) < 0xffff:
+        typecode, missing = 'H', 0xffff
+    elif whole and max(finite, default=0) < 0xffffffff:
+        typecode, missing = 'I', 0xffffffff
+    else:
+        typecode, missing = 'd', inf
+    table = array(typecode, (missing if cost == inf else int(cost) if whole else cost for cost in costs))
+    os.makedirs(cache_dir, exist_ok=True)
+    write_atomically(os.path.join(cache_dir, key + '.bin'), table.tobytes())
+    write_atomically(os.path.join(cache_dir, key + '.json'),
+                     json.dumps({'typecode': typecode, 'missing': missing if missing != inf else None}).encode())
+
+
+def load_pattern_database(cache_dir, key):
+    # Memory-maps a stored pattern database: (costs, value meaning inf), or None if there isn't one
+    try:
+        with open(os.path.join(cache_dir, key + '.json')) as f:
+            meta = json.load(f)
+        with open(os.path.join(cache_dir, key + '.bin'), 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    missing = inf if meta['missing'] is None else meta['missing']
+    return memoryview(mapped).cast(meta['typecode']), missing
+
+
+def load_pattern_databases(crafting, item_index, cache_dir=None, max_size=PDB_MAX_SIZE):
+    # The pattern databases for crafting's recipes and goal, as (pattern, caps, costs, value
+    # meaning inf): read from cache_dir when they were built before, otherwise built (and
+    # saved there, when there is a cache_dir).
+    caps = abstraction_caps(crafting, item_index)
+    whole = all(float(rule['Time']).is_integer() for rule in crafting['Recipes'].values())
+    databases = []
+    for pattern in choose_patterns(crafting, item_index, caps, max_size):
+        key = pattern_database_key(crafting, pattern, caps)
+        loaded = load_pattern_database(cache_dir, key) if cache_dir else None
+        if loaded is None:
+            costs = build_pattern_database(crafting, item_index, pattern, caps)
+            if cache_dir:
+                store_pattern_database(cache_dir, key, costs, whole)
+                loaded = load_pattern_database(cache_dir, key)
+            else:
+                loaded = costs, inf
+        databases.append((pattern, tuple(caps[i] for i in pattern)) + tuple(loaded))
+    return databases
+
+
+def make_pdb_heuristic(databases, estimate=None):
+    # Returns an admissible heuristic: the most any pattern database (or estimate) says is
+    # still needed. Each lookup projects the state onto the pattern, topping counts out at
+    # their caps, and reads one array slot.
+    lookups = []
+    for pattern, caps, costs, missing in databases:
+        strides = [1] * len(pattern)
+        for j in range(len(pattern) - 2, -1, -1):
+            strides[j] = strides[j + 1] * (caps[j + 1] + 1)
+        lookups.append((tuple(zip(pattern, caps, strides)), costs, missing))
+
+    def pdb_heuristic(state, action_name):
+        best = estimate(state, action_name) if estimate else 0
+        for digits, costs, missing in lookups:
+            index = 0
+            for i, cap, stride in digits:
+                value = state[i]
+                index += (value if value < cap else cap) * stride
+            cost = costs[index]
+            if cost == missing:
+                return inf
+            if cost > best:
+                best = cost
+        return best
+
+    return pdb_heuristic
+
+
+# The --heuristic names choose_heuristic knows
+HEURISTICS = ('prune', 'caps', 'bound', 'capped-bound', 'pdb')
+
+
+def choose_heuristic(name, crafting, item_index, cache_dir=None):
+    # The heuristic for a --heuristic name. Pattern databases are kept in cache_dir if given.
+    if name not in HEURISTICS:
+        raise ValueError('unknown heuristic %r' % name)
+    if name == 'pdb':
+        databases = load_pattern_databases(crafting, item_index, cache_dir)
+        return make_cap_heuristic(crafting, item_index,
+                                  make_pdb_heuristic(databases, make_bound_heuristic(crafting, item_index)))
+    if name == 'caps':
+        return make_cap_heuristic(crafting, item_index)
+    if name == 'bound':
+        return make_bound_heuristic(crafting, item_index)
+    if name == 'capped-bound':
+        return make_cap_heuristic(crafting, item_index, make_bound_heuristic(crafting, item_index))
+    return make_prune_heuristic(crafting, item_index)
+
+
+class HeapFrontier:
+    """ Binary-heap frontier, works for any priorities. Ties go to the most recently pushed node
+        (usually the deepest one), using a push counter rather than comparing states.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = count(0, -1)
+
+    def push(self, priority, node, cost):
+        heappush(self.heap, (priority, next(self.counter), node, cost))
+
+    def pop(self):
+        priority, _, node, cost = heappop(self.heap)
+        return priority, node, cost
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class BucketFrontier:
+    """ Bucket queue for whole-number priorities (recipe Times are small integers): one list per
+        priority, so push and pop are O(1) apart from moving on to the next bucket when one runs
+        out. Ties are broken the same way as HeapFrontier, so both expand nodes in the same order.
+        -inf priorities (the pruning heuristic's "always do this") get a bucket of their own.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.urgent = []
+        self.lowest = inf
+        self.size = 0
+
+    def push(self, priority, node, cost):
+        self.size += 1
+        if priority == -inf:
+            self.urgent.append((node, cost))
+            return
+        bucket = self.buckets.get(priority)
+        if bucket is None:
+            bucket = self.buckets[priority] = []
+            if priority < self.lowest:
+                self.lowest = priority
+        bucket.append((node, cost))
+
+    def pop(self):
+        self.size -= 1
+        if self.urgent:
+            node, cost = self.urgent.pop()
+            return -inf, node, cost
+        priority = self.lowest
+        bucket = self.buckets[priority]
+        node, cost = bucket.pop()
+        if not bucket:
+            del self.buckets[priority]
+            self.lowest = min(self.buckets) if self.buckets else inf
+        return priority, node, cost
+
+    def __len__(self):
+        return self.size
+
+
+def choose_frontier(crafting):
+    # Bucket queue when every recipe Time is a whole number (so priorities are too, with
+    # the heuristics here), otherwise fall back to the binary heap
+    if all(float(rule['Time']).is_integer() for rule in crafting['Recipes'].values()):
+        return BucketFrontier
+    return HeapFrontier
+
+
+# Most tree nodes one DominanceIndex lookup looks at, over all the buckets it searches
+DOMINANCE_BUDGET = 48
+
+
+class DominanceTree:
+    """ The states in one DominanceIndex bucket: a k-d tree over their resource counts and
+        negated cost, so "at least as much of everything for no more cost" is just "at least as
+        big in every dimension". Every subtree keeps the smallest and biggest value in each
+        dimension under it, so both lookups skip whole subtrees that can't hold an answer.
+        Beaten entries are only marked dead; the corners are left as they were, which only
+        makes them looser, never wrong. When an insert makes the tree too deep, a lopsided
+        subtree on its path is rebuilt around its medians (dropping its dead entries), so the
+        tree stays shallow whatever order states come in.
+    """
+
+    def __init__(self):
+        # Nodes are [vector, node id, alive, left, right, low corner, high corner, split dimension,
+        # size]; the left subtree holds vectors no bigger than the node's in its split dimension,
+        # the right one vectors no smaller
+        self.root = None
+
+    def build(self, entries):
+        # A balanced subtree over (vector, node id) pairs, split at the median of the dimension
+        # with the widest spread. Ties can land on either side: the lookups go by the corners,
+        # not the split, so that only costs a little pruning.
+        if not entries:
+            return None
+        if len(entries) == 1:
+            vector, node = entries[0]
+            return [vector, node, True, None, None, vector, vector, 0, 1]
+        columns = list(zip(*(vector for vector, _ in entries)))
+        dim = max(range(len(columns)), key=lambda dim: max(columns[dim]) - min(columns[dim]))
+        entries = sorted(entries, key=lambda entry: entry[0][dim])
+        middle = len(entries) // 2
+        vector, node = entries[middle]
+        left = self.build(entries[:middle])
+        right = self.build(entries[middle + 1:])
+        low = high = vector
+        for child in (left, right):
+            if child:
+                low = tuple(map(min, low, child[5]))
+                high = tuple(map(max, high, child[6]))
+        return [vector, node, True, left, right, low, high, dim, len(entries)]
+
+    def live(self, subtree):
+        stack = [subtree]
+        entries = []
+        while stack:
+            current = stack.pop()
+            if current[2]:
+                entries.append((current[0], current[1]))
+            if current[3]:
+                stack.append(current[3])
+            if current[4]:
+                stack.append(current[4])
+        return entries
+
+    def insert(self, vector, node):
+        if self.root is None:
+            self.root = self.build([(vector, node)])
+            return
+        path = []
+        current = self.root
+        while current is not None:
+            path.append(current)
+            current[5] = tuple(map(min, current[5], vector))
+            current[6] = tuple(map(max, current[6], vector))
+            current[8] += 1
+            side = 3 if vector[current[7]] < current[0][current[7]] else 4
+            if current[side] is None:
+                current[side] = self.build([(vector, node)])
+                break
+            current = current[side]
+        # If that made the path too deep for the tree's size, rebuild from the highest node with
+        # one side holding most of its subtree (a scapegoat tree). The sizes above it go on
+        # counting entries a rebuild dropped, which only puts off their own rebuilds.
+        if len(path) <= 2 * self.root[8].bit_length() + 2:
+            return
+        for depth, current in enumerate(path):
+            bigger = max(current[3][8] if current[3] else 0, current[4][8] if current[4] else 0)
+            if bigger > 0.7 * current[8]:
+                rebuilt = self.build(self.live(current))
+                if depth == 0:
+                    self.root = rebuilt
+                else:
+                    parent = path[depth - 1]
+                    parent[3 if parent[3] is current else 4] = rebuilt
+                return
+
+    def any_above(self, vector, budget):
+        # Whether a live entry is at least vector in every dimension, looking at no more than
+        # budget nodes (giving up just means the state doesn't get dropped), and the budget left
+        stack = [self.root] if self.root else []
+        while stack and budget:
+            budget -= 1
+            current = stack.pop()
+            if not all(map(ge, current[6], vector)):
+                continue
+            if current[2] and all(map(ge, current[0], vector)):
+                return True, budget
+            if current[3]:
+                stack.append(current[3])
+            if current[4]:
+                stack.append(current[4])
+        return False, budget
+
+    def remove_below(self, vector, budget):
+        # Marks the live entries that are at most vector in every dimension dead, looking at no
+        # more than budget nodes (any it misses just get expanded). Returns their ids and the
+        # budget left.
+        removed = []
+        stack = [self.root] if self.root else []
+        while stack and budget:
+            budget -= 1
+            current = stack.pop()
+            if not all(map(ge, vector, current[5])):
+                continue
+            if current[2] and all(map(ge, vector, current[0])):
+                current[2] = False
+                removed.append(current[1])
+            if current[3]:
+                stack.append(current[3])
+            if current[4]:
+                stack.append(current[4])
+        return removed, budget
+
+
+class DominanceIndex:
+    """ Remembers the states pushed so far so search() can drop a new state when an old one has
+        at least as much of every item for no more cost: any plan from the new state also works
+        from the old one, at the same cost. It also works the other way round: add() hands back
+        the old nodes the new state beats, so search() can skip them when they come out of the
+        frontier. States are bucketed by the tools they hold, and each bucket is a DominanceTree
+        over the rest, so a lookup only searches buckets with at least (or at most) the same
+        tools, and only the parts of their trees that could hold an answer.
+        The planner only uses it backwards (RequirementDominanceIndex), where it cuts the
+        requirements searched several times over. Forwards, on crafting.json, it drops so few
+        states that the lookups make A* about ten times slower, so there's no option for it.
+    """
+
+    def __init__(self, crafting, item_index, budget=DOMINANCE_BUDGET):
+        self.budget = budget
+        tools = set(find_tools(crafting))
+        self.tool_indices = tuple(item_index[item] for item in crafting['Items'] if item in tools)
+        self.resource_indices = tuple(item_index[item] for item in crafting['Items'] if item not in tools)
+        self.buckets = {}  # tool counts -> DominanceTree of resource counts + (-cost,)
+        self.covering = {}  # tool counts -> buckets holding at least those tools
+        self.covered = {}  # tool counts -> buckets holding at most those tools
+        self.checked = 0
+        self.pruned = 0
+        self.replaced = 0
+
+    def split(self, state):
+        return tuple(state[i] for i in self.tool_indices), tuple(state[i] for i in self.resource_indices)
+
+    def dominated(self, state, cost):
+        self.checked += 1
+        tools, resources = self.split(state)
+        buckets = self.covering.get(tools)
+        if buckets is None:
+            # (nearest first, since they're the likeliest to hold a dominating state)
+            buckets = self.covering[tools] = [bucket for key, bucket in sorted(self.buckets.items(),
+                                                                               key=lambda item: sum(item[0]))
+                                              if all(map(ge, key, tools))]
+        vector = resources + (-cost,)
+        budget = self.budget
+        for bucket in buckets:
+            found, budget = bucket.any_above(vector, budget)
+            if found:
+                self.pruned += 1
+                return True
+            if not budget:
+                break
+        return False
+
+    def add(self, state, cost, node):
+        # Returns the nodes of older states that this one beats, and forgets them
+        tools, resources = self.split(state)
+        bucket = self.buckets.get(tools)
+        if bucket is None:
+            bucket = self.buckets[tools] = DominanceTree()
+            self.covering = {}
+            self.covered = {}
+        buckets = self.covered.get(tools)
+        if buckets is None:
+            buckets = self.covered[tools] = [bucket for key, bucket in sorted(self.buckets.items(),
+                                                                              key=lambda item: -sum(item[0]))
+                                             if all(map(ge, tools, key))]
+        vector = resources + (-cost,)
+        beaten = []
+        budget = self.budget
+        for other in buckets:
+            removed, budget = other.remove_below(vector, budget)
+            for other_node in removed:
+                if other_node != node:
+                    # (an older entry for this very node just means we found it cheaper)
+                    beaten.append(other_node)
+            if not budget:
+                break
+        self.replaced += len(beaten)
+        bucket.insert(vector, node)
+        return beaten
+
+
+class RequirementDominanceIndex(DominanceIndex):
+    """ DominanceIndex for regression, where the states are requirements and less is better: a
+        requirement is beaten by one asking for no more of anything, for no more cost. Storing
+        every count negated turns that into the usual "at least as much of everything".
+    """
+
+    def split(self, requirement):
+        return (tuple(-requirement[i] for i in self.tool_indices),
+                tuple(-requirement[i] for i in self.resource_indices))
+
+
+class SearchStats:
+    """ What one search() run did: nodes expanded and generated, duplicates (seen before, no
+        cheaper), re-openings (seen before, now cheaper), pruned (inf priority) and stale frontier
+        entries, the biggest the frontier got, and the time taken. With timings=True it also
+        times graph(), the heuristic and the frontier separately (through timed_* wrappers, which
+        also show up by name under a sampling profiler), and with attribute_pruning=True it
+        counts which line of the heuristic each inf came from. Both slow the search down.
+        Attributing pruning needs the interpreter's profile hook around each heuristic call, so
+        a profiler (cProfile, say) sees nothing inside the heuristic while it's on.
+    """
+
+    def __init__(self, timings=False, attribute_pruning=False):
+        self.timings = timings
+        self.attribute_pruning = attribute_pruning
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.reopened = 0
+        self.pruned = 0
+        self.stale = 0
+        self.peak_frontier = 0
+        self.elapsed = 0
+        self.outcome = None  # 'plan', 'exhausted' (nothing left to try) or 'stopped' (cut short)
+        self.graph_time = 0
+        self.heuristic_time = 0
+        self.frontier_time = 0
+        self.prune_lines = defaultdict(int)  # (file, line) -> infs returned from there
+
+    def timed_graph(self, graph):
+        def timed_graph(state):
+            start = time()
+            successors = list(graph(state))
+            self.graph_time += time() - start
+            return successors
+
+        return timed_graph
+
+    def timed_heuristic(self, heuristic):
+        returns = []
+
+        def tracer(frame, event, arg):
+            if event == 'return':
+                returns.append((frame.f_code.co_filename, frame.f_lineno, arg))
+
+        def timed_heuristic(state, action_name):
+            start = time()
+            if self.attribute_pruning:
+                returns.clear()
+                previous = sys.getprofile()
+                sys.setprofile(tracer)
+                try:
+                    value = heuristic(state, action_name)
+                finally:
+                    sys.setprofile(previous)
+                if value == inf:
+                    # The inf is passed back up through any wrappers (the caps heuristic around
+                    # the bound, say); the first of that run of returns is where it came from
+                    n = len(returns) - 1
+                    while n > 0 and returns[n - 1][2] == inf:
+                        n -= 1
+                    if returns:
+                        self.prune_lines[returns[n][:2]] += 1
+            else:
+                value = heuristic(state, action_name)
+            self.heuristic_time += time() - start
+            return value
+
+        return timed_heuristic
+
+    def timed_frontier(self, frontier):
+        push, pop = frontier.push, frontier.pop
+
+        def timed_push(priority, node, cost):
+            start = time()
+            push(priority, node, cost)
+            self.frontier_time += time() - start
+
+        def timed_pop():
+            start = time()
+            entry = pop()
+            self.frontier_time += time() - start
+            return entry
+
+        frontier.push, frontier.pop = timed_push, timed_pop
+        return frontier
+
+    def prune_rules(self):
+        # [(count, "file:line  comment or code")] for every line that returned inf, most first
+        rules = []
+        for (filename, line), times in self.prune_lines.items():
+            label = linecache.getline(filename, line).strip()
+            # Name the rule by the comment above its if, when it has one
+            for above in range(line - 1, max(line - 4, 0), -1):
+                text = linecache.getline(filename, above).strip()
+                if text.startswith('#'):
+                    label = text.lstrip('#').strip()
+                    break
+            rules.append((times, '%s:%d  %s' % (os.path.basename(filename), line, label)))
+        rules.sort(reverse=True)
+        return rules
+
+    def report(self):
+        lines = ['expanded %d, generated %d, duplicates %d, re-opened %d, pruned %d, stale %d, peak frontier %d'
+                 % (self.expanded, self.generated, self.duplicates, self.reopened, self.pruned, self.stale,
+                    self.peak_frontier),
+                 '%.3f seconds, %.0f nodes/second' % (self.elapsed, self.expanded / self.elapsed if self.elapsed else 0)]
+        if self.timings:
+            lines.append('graph %.3fs, heuristic %.3fs, frontier %.3fs'
+                         % (self.graph_time, self.heuristic_time, self.frontier_time))
+        for times, rule in self.prune_rules():
+            lines.append('%8d  %s' % (times, rule))
+        return '\n'.join(lines)
+
+
+# Expansions search_steps does between progress reports (and search() between time checks)
+SEARCH_SLICE = 1000
+
+SearchProgress = namedtuple('SearchProgress', ['expanded', 'generated', 'frontier', 'f', 'best_h', 'plan', 'elapsed'])
+
+
+def search_steps(graph, state, is_goal, heuristic, frontier=HeapFrontier, dominance=None, skip_after=None,
+                 upper_bound=inf, stats=None, hooks=None, slice_size=SEARCH_SLICE):
+    # A* as a generator, so it can be run a slice at a time. Every slice_size expansions it
+    # yields a SearchProgress: states expanded and generated so far, the frontier size, the
+    # f-cost being expanded (a lower bound on the optimal cost with an admissible heuristic),
+    # and the action names to the expanded state with the smallest heuristic value (best_h),
+    # the one that looks closest to the goal. Stop it with close() and carry on with next();
+    # it has no time limit of its own. When it ends it returns (pathCells, cost, states
+    # searched) through StopIteration, with pathCells and cost None if there's no plan.
+    # With an admissible heuristic, upper_bound (the cost of a plan we already have) drops every
+    # node that can't lead to one at least as cheap.
+    # stats, a SearchStats, is filled in with what the search did. hooks is a dict of optional
+    # callbacks: 'expand'(state, cost), 'generate'(state, action, cost, priority) and
+    # 'goal'(state, cost).
+    start_time = time()
+    forget = getattr(graph, 'forget', None)  # (see make_incremental_graph)
+    if stats is not None and stats.timings:
+        graph = stats.timed_graph(graph)
+    if stats is not None and (stats.timings or stats.attribute_pruning):
+        heuristic = stats.timed_heuristic(heuristic)
+    hooks = hooks or {}
+    on_expand = hooks.get('expand')
+    on_generate = hooks.get('generate')
+    on_goal = hooks.get('goal')
+
+    # Node table: every state we've seen gets an id the first time, and is only stored once.
+    # Everything else about the node lives in lists indexed by that id.
+    node_ids = {state: 0}
+    states = [state]
+    came_from = [None]  # parent id
+    cost_so_far = [0]  # g-cost
+    action_to_state = [None]  # name of the action that led here
+    closed = bytearray(1)  # 1 once expanded, a node is never expanded twice
+
+    # Frontier entries are (priority, id, g-cost at push time). Finding a cheaper path just pushes
+    # a new entry; the old one is recognised as stale when it comes out and skipped.
+    frontQueue = frontier()
+    if stats is not None and stats.timings:
+        stats.timed_frontier(frontQueue)
+    frontQueue.push(0, 0, 0)
+    beaten_at = {}  # nodes the dominance index has beaten, and their cost at the time
+    if dominance is not None:
+        dominance.add(state, 0, 0)
+    states_searched = 0
+    generated = duplicates = reopened = pruned = stale = peak_frontier = 0
+    report_at = slice_size
+    best_h, best_node = inf, 0
+    outcome = 'stopped'
+    try:
+        while frontQueue:
+            if len(frontQueue) > peak_frontier:
+                peak_frontier = len(frontQueue)
+            priority, current, pushed_cost = frontQueue.pop()
+            if priority == inf:
+                # Everything left has been pruned
+                break
+            if closed[current] or pushed_cost != cost_so_far[current]:
+                stale += 1
+                continue
+            if beaten_at.get(current) == pushed_cost:
+                stale += 1
+                if forget:
+                    forget(states[current])
+                continue
+            closed[current] = 1
+            states_searched += 1
+            current_state = states[current]
+            current_cost = cost_so_far[current]
+            if current and priority - current_cost < best_h:  # (the start goes in with priority 0, not its h)
+                best_h, best_node = priority - current_cost, current
+            if on_expand:
+                on_expand(current_state, current_cost)
+
+            #is what happens if we find destination
+            if is_goal(current_state):
+                if on_goal:
+                    on_goal(current_state, current_cost)
+                pathCells = []
+                node = current
+                while node != 0:
+                    pathCells.append((states[node], action_to_state[node])) #append the state and the action that led to it
+                    node = came_from[node]
+                pathCells.reverse()
+                outcome = 'plan'
+                return pathCells, current_cost, states_searched
+
+            if states_searched == report_at:
+                report_at += slice_size
+                plan = []
+                node = best_node
+                while node != 0:
+                    plan.append(action_to_state[node])
+                    node = came_from[node]
+                plan.reverse()
+                yield SearchProgress(states_searched, generated, len(frontQueue), priority, best_h, plan,
+                                     time() - start_time)
+
+            # With partial-order reduction, independent actions only ever follow each other in one order
+            skip = skip_after.get(action_to_state[current], ()) if skip_after else ()
+
+            # (every successor that doesn't get pushed is forgotten, so the graph can let go of
+            # anything it keeps for it)
+            for name, new_state, cost in graph(current_state):
+                if name in skip:
+                    if forget:
+                        forget(new_state)
+                    continue
+                generated += 1
+                new_cost = current_cost + cost
+                if new_cost == inf:
+                    if forget:
+                        forget(new_state)
+                    continue
+                node = node_ids.get(new_state)
+                if node is None:
+                    node = len(states)
+                    node_ids[new_state] = node
+                    states.append(new_state)
+                    came_from.append(current)
+                    cost_so_far.append(new_cost)
+                    action_to_state.append(name)
+                    closed.append(0)
+                elif closed[node] or new_cost >= cost_so_far[node]:
+                    duplicates += 1
+                    if forget:
+                        forget(new_state)
+                    continue
+                else:
+                    reopened += 1
+                    came_from[node] = current
+                    cost_so_far[node] = new_cost
+                    action_to_state[node] = name
+                priority = new_cost + heuristic(new_state, name)
+                if on_generate:
+                    on_generate(new_state, name, new_cost, priority)
+                if priority == inf:
+                    pruned += 1
+                # (dominance is only checked for states that would be pushed, since it costs more
+                # than the heuristic)
+                elif priority <= upper_bound and not (dominance is not None
+                                                      and dominance.dominated(new_state, new_cost)):
+                    frontQueue.push(priority, node, new_cost)
+                    if dominance is not None:
+                        for beaten in dominance.add(new_state, new_cost, node):
+                            # A state with at least as much for no more cost is on the way, so
+                            # there's no point expanding this one at its current cost
+                            beaten_at[beaten] = cost_so_far[beaten]
+                    continue
+                if forget:
+                    forget(new_state)
+
+        # Failed to find a path
+        outcome = 'exhausted'
+        return None, None, states_searched
+    finally:
+        # However it stops (a plan, no plan, or closed part way through)
+        if stats is not None:
+            stats.expanded, stats.generated, stats.duplicates, stats.reopened, stats.pruned, stats.stale = (
+                states_searched, generated, duplicates, reopened, pruned, stale)
+            stats.peak_frontier, stats.elapsed = peak_frontier, time() - start_time
+            stats.outcome = outcome
+
+
+def search(graph, state, is_goal, limit, heuristic, frontier=HeapFrontier, dominance=None, skip_after=None,
+           upper_bound=inf, stats=None, hooks=None, stop=None):
 
     start_time = time()
 
@@ -217,84 +1645,1058 @@ def search(graph, state, is_goal, limit, heuristic):
     # representing the path. Each element (tuple) of the list represents a state
     # in the path and the action that took you to this state
 
-    #Set the caps for resources
-    global caps
-    caps = {}
-    for item, amount in Crafting['Goal'].items():
-        caps[item] = amount
+    # Runs search_steps (see there for the options) to the end, looking at the clock once a
+    # slice rather than once a state, and gives up once limit seconds have gone, or once stop
+    # (an Event, if given) is set. The states in the plan are count tuples like state;
+    # make_state_view turns them into States to print.
+    steps = search_steps(graph, state, is_goal, heuristic, frontier, dominance, skip_after, upper_bound, stats,
+                         hooks)
+    states_searched = 0
+    while time() - start_time < limit and not (stop is not None and stop.is_set()):
+        try:
+            states_searched = next(steps).expanded
+        except StopIteration as done:
+            pathCells, cost, states_searched = done.value
+            if pathCells is not None:
+                return pathCells, time() - start_time, cost, states_searched
+            break
+    steps.close()
 
-    frontQueue = []
-    heappush(frontQueue, (0, state))
+    # Failed to find a path
+    print(time() - start_time, 'seconds.')
+    print("Failed to find a path within time limit.")
+    return None, None, None, states_searched
 
-    came_from = dict()
-    cost_so_far = dict()
-    action_to_state = dict()
 
-    action_to_state[state] = None
-    came_from[state] = None
-    cost_so_far[state] = 0
+async def search_async(graph, state, is_goal, heuristic, deadline=None, progress=None, slice_size=200, **options):
+    # search() for asyncio: runs search_steps a slice at a time and gives the event loop a turn
+    # after each one, so any number of searches (and everything else on the loop) can share
+    # one thread. deadline is a loop.time() value, so several tasks can share one, and
+    # progress, if given, is called with every SearchProgress. Cancelling the task stops the
+    # search within a slice. Other keyword options go to search_steps. Returns what search()
+    # does, with no plan if the deadline passed first.
+    loop = asyncio.get_running_loop()
+    start_time = time()
+    steps = search_steps(graph, state, is_goal, heuristic, slice_size=slice_size, **options)
     states_searched = 0
-    while frontQueue and time() - start_time < limit:
-        _, current_state = heappop(frontQueue)
-        states_searched += 1
-        #if current_state in action_to_state:
-        #    print (action_to_state[current_state])
-        #print(current_state)
-        #print (_)
-        if _ == inf:
-            #print (frontQueue[0:100])
-            break
+    try:
+        while deadline is None or loop.time() < deadline:
+            try:
+                report = next(steps)
+            except StopIteration as done:
+                pathCells, cost, states_searched = done.value
+                if pathCells is None:
+                    break
+                return pathCells, time() - start_time, cost, states_searched
+            states_searched = report.expanded
+            if progress:
+                progress(report)
+            await asyncio.sleep(0)
+    finally:
+        steps.close()
+    return None, None, None, states_searched
 
-    #    if current_state["wooden_pickaxe"] == 1:
-    #        if current_state["wooden_axe"] == 0:
-    #            print("aha")
-    #            print(new_state["cobble"])
-
-    #    if current_state["wooden_axe"] == 0:
-        #    if current_state["stone_pickaxe"] == 1:
-        #        print("WWWWWWWWWWW")
-    #----------------------------------------------------------------
-    #is what happens if we find destination
-        if is_goal(current_state):
-            #print (cost_so_far[current_state])
+
+def anytime_search(graph, state, is_goal, limit, heuristic, weights=(5, 3, 2, 1.5, 1.2, 1)):
+    # Anytime A* (ARA*): weighted A* with priority g + weight * h for each weight in turn.
+    # A big weight finds some plan quickly; every later round reuses the previous open list
+    # (plus nodes that got cheaper after being closed) instead of starting over, and only
+    # expands nodes that could still beat the best plan so far. This is a generator: every time
+    # a round improves the plan it yields (plan, seconds so far, cost, lower bound on the
+    # optimal cost, states searched), so the last thing it yields before the time limit is the
+    # best plan found. The lower bound is only meaningful with an admissible heuristic, and the
+    # final round (weight 1) proves the plan optimal if it gets to finish.
+
+    start_time = time()
+    forget = getattr(graph, 'forget', None)  # (see make_incremental_graph)
+
+    # Same node table as search(), plus the heuristic value of each node
+    node_ids = {state: 0}
+    states = [state]
+    came_from = [None]
+    cost_so_far = [0]
+    action_to_state = [None]
+    estimates = [max(heuristic(state, ''), 0)]
+
+    open_nodes = {0}
+    incons = set()
+    best = 0 if is_goal(state) else None
+    best_cost = 0 if best is not None else inf
+    reported = inf
+    states_searched = 0
+
+    for weight in weights:
+        # Start the round from everything still open plus everything that got cheaper while closed
+        open_nodes |= incons
+        incons = set()
+        closed = set()
+        frontQueue = HeapFrontier()
+        for node in open_nodes:
+            frontQueue.push(cost_so_far[node] + weight * estimates[node], node, cost_so_far[node])
+
+        while frontQueue and time() - start_time < limit:
+            priority, current, pushed_cost = frontQueue.pop()
+            if current not in open_nodes or pushed_cost != cost_so_far[current]:
+                continue
+            if priority >= best_cost:
+                # Nothing left in this round can beat the plan we have
+                break
+            open_nodes.discard(current)
+            closed.add(current)
+            states_searched += 1
+            current_cost = cost_so_far[current]
+
+            for name, new_state, cost in graph(states[current]):
+                new_cost = current_cost + cost
+                node = node_ids.get(new_state)
+                if node is None:
+                    node = len(states)
+                    node_ids[new_state] = node
+                    states.append(new_state)
+                    came_from.append(current)
+                    cost_so_far.append(new_cost)
+                    action_to_state.append(name)
+                    estimates.append(heuristic(new_state, name))
+                elif new_cost >= cost_so_far[node]:
+                    if forget:
+                        forget(new_state)
+                    continue
+                else:
+                    came_from[node] = current
+                    cost_so_far[node] = new_cost
+                    action_to_state[node] = name
+                    estimates[node] = heuristic(new_state, name)
+                if estimates[node] == inf:
+                    if forget:
+                        forget(new_state)
+                    continue
+                if new_cost < best_cost and is_goal(new_state):
+                    best = node
+                    best_cost = new_cost
+                if node in closed:
+                    incons.add(node)
+                else:
+                    open_nodes.add(node)
+                    frontQueue.push(new_cost + weight * estimates[node], node, new_cost)
+
+        if best is not None and best_cost < reported:
+            reported = best_cost
             pathCells = []
-            cs = current_state
-            while cs is not state:
-                action = action_to_state[cs] #action to lead up to previous state
-                pathCells.append((cs, action)) #append previous state and the action
-                cs = came_from[cs] #go back one, this has to be on the end because otherwise we might be putting in None. I guess I can do while came_from[cs] is not none but too late im sticking with it
+            node = best
+            while node != 0:
+                pathCells.append((states[node], action_to_state[node]))
+                node = came_from[node]
             pathCells.reverse()
-            final_time = time() - start_time
-            return pathCells,final_time, cost_so_far[current_state], states_searched
-    #-----------------------------------------------------------------
-
-        for name, new_state, cost_to_state in graph(current_state):
-            cost = cost_to_state
-            new_cost = cost_so_far[current_state] + cost
-            if new_cost != inf and (new_state not in cost_so_far or new_cost < cost_so_far[new_state]):
-                #print("adding")
-                cost_so_far[new_state] = new_cost
+            lower = min([best_cost] + [cost_so_far[node] + estimates[node] for node in open_nodes | incons])
+            yield pathCells, time() - start_time, best_cost, max(lower, 0), states_searched
+        if time() - start_time >= limit:
+            break
+
+    if best is None:
+        # Failed to find a path
+        print(time() - start_time, 'seconds.')
+        print("Failed to find a path within time limit.")
+
+
+def memory_bounded_search(graph, state, is_goal, limit, heuristic, max_nodes):
+    # Iterative deepening A*: depth-first search that gives up on any node whose f-cost is
+    # over the current bound, raising the bound to the smallest f-cost that went over each
+    # time round. It only keeps the current path in memory, plus a transposition table of at
+    # most max_nodes states (cheapest g seen this round) so it doesn't redo the same
+    # inventories over and over. Once the table is full the search carries on without adding
+    # to it: slower, but memory stays put (a plan longer than max_nodes still needs its whole
+    # path, though). Plans are optimal with an admissible heuristic.
+    # Returns the same as search(), plus the most nodes held at once.
+
+    start_time = time()
+    forget = getattr(graph, 'forget', None)  # (see make_incremental_graph)
+    states_searched = 0
+    peak_nodes = 0
+
+    bound = heuristic(state, '')
+    if bound == -inf:
+        bound = 0
+    while bound != inf and time() - start_time < limit:
+        next_bound = inf
+        seen = {state: 0}
+        path = [(state, None)]
+        on_path = {state}
+        stack = [(0, graph(state))]  # g-cost of each node on the path and its remaining successors
+        states_searched += 1
+        if is_goal(state):
+            return [], time() - start_time, 0, states_searched, 1
+        while stack:
+            if time() - start_time >= limit:
+                break
+            g, successors = stack[-1]
+            for name, new_state, cost in successors:
+                new_cost = g + cost
+                if new_state in on_path or seen.get(new_state, inf) <= new_cost:
+                    if forget:
+                        forget(new_state)
+                    continue
                 priority = new_cost + heuristic(new_state, name)
-                #if new_state["wooden_pickaxe"] == 1:
-                #    if new_state["wooden_axe"] == 0:
-                #        if new_state["cobble"] == 3:
-                #            print(new_state)
-                #            print(new_cost)
-                #            print(priority)
-                #            print (name)
-                heappush(frontQueue, (priority, new_state))
-                came_from[new_state] = current_state
-                action_to_state[new_state] = name
-    #            print(new_state)
+                if priority > bound:
+                    if priority < next_bound:
+                        next_bound = priority
+                    if forget:
+                        forget(new_state)
+                    continue
+                if len(seen) + len(path) < max_nodes:
+                    seen[new_state] = new_cost
+                path.append((new_state, name))
+                on_path.add(new_state)
+                states_searched += 1
+                if is_goal(new_state):
+                    peak_nodes = max(peak_nodes, len(seen) + len(path))
+                    pathCells = path[1:]
+                    return pathCells, time() - start_time, new_cost, states_searched, peak_nodes
+                stack.append((new_cost, graph(new_state)))
+                break
+            else:
+                # Nothing left under this node, back up
+                stack.pop()
+                on_path.discard(path.pop()[0])
+            if len(seen) + len(path) > peak_nodes:
+                peak_nodes = len(seen) + len(path)
+        bound = next_bound
 
     # Failed to find a path
     print(time() - start_time, 'seconds.')
-    print("Failed to find a path from", state, 'within time limit.')
-    return None, None, None
+    print("Failed to find a path within time limit.")
+    return None, None, None, states_searched, peak_nodes
+
+def make_batch_producer(crafting, item_index):
+    # Returns produce(stock, demand, held): how many times to fire each recipe so the stock
+    # ends up with at least demand[i] of every item, using only recipes whose tools are in
+    # held. Each item is made with the recipe that is cheapest per unit (counting what it
+    # eats) under those tools, and counts are worked out top-down, products before what
+    # they're made of, so the work doesn't depend on how many of anything is asked for.
+    # Returns (firings in the order to fire them as [(recipe name, times)], new stock, cost),
+    # or None if something demanded can't be made with those tools, or the firings can't be
+    # carried out in that order (a cycle among the chosen recipes, say).
+    rules = {}
+    for name, rule in crafting['Recipes'].items():
+        need, delta = rule_vectors(rule, item_index)
+        requires = [item_index[item] for item in rule.get('Requires', {})]
+        consumed = [(i, -change) for i, change in enumerate(delta) if change < 0]
+        produced = [(i, change) for i, change in enumerate(delta) if change > 0]
+        rules[name] = (rule['Time'], requires, consumed, produced, delta, need)
+
+    choices = {}
+
+    def choose(held):
+        # Cheapest recipe per unit of each item with these tools (Bellman-Ford, as in
+        # compute_item_values)
+        if held in choices:
+            return choices[held]
+        unit = [inf] * len(item_index)
+        choice = [None] * len(item_index)
+        usable = [rule for rule in rules.items() if all(i in held for i in rule[1][1])]
+        for _ in range(len(unit) + 1):
+            changed = False
+            for name, (cost, _, consumed, produced, _, _) in usable:
+                inputs = cost + sum(amount * unit[i] for i, amount in consumed)
+                for i, amount in produced:
+                    if inputs / amount < unit[i] - 1e-12:
+                        unit[i] = inputs / amount
+                        choice[i] = name
+                        changed = True
+            if not changed:
+                break
+        choices[held] = choice
+        return choice
+
+    def produce(stock, demand, held):
+        start = stock
+        choice = choose(held)
+        # Products before ingredients: reversed depth-first postorder over the chosen recipes
+        order = []
+        visited = set()
+
+        def visit(i):
+            visited.add(i)
+            if choice[i] is not None:
+                for j, _ in rules[choice[i]][2]:
+                    if j not in visited:
+                        visit(j)
+            order.append(i)
+
+        for i in demand:
+            if i not in visited:
+                visit(i)
+        order.reverse()
+
+        required = defaultdict(int, demand)
+        stock = list(stock)
+        firings = []
+        total = 0
+        for i in order:
+            short = required[i] - stock[i]
+            if short <= 0:
+                continue
+            if choice[i] is None:
+                return None
+            cost, _, consumed, produced, _, _ = rules[choice[i]]
+            times = ceil(short / dict(produced)[i])
+            for j, amount in consumed:
+                required[j] += times * amount
+            # Only add what it makes: what it eats is in required, and comes off at the end
+            for j, amount in produced:
+                stock[j] += times * amount
+            firings.append((choice[i], times))
+            total += times * cost
+        firings.reverse()
+        # Fire them on the starting stock: the counts above assume every ingredient is made
+        # before what eats it, which a cycle among the chosen recipes (or a by-product that
+        # only turns up later) breaks. A batch's counts change by the same amount each time,
+        # so checking its first and last firing covers the ones in between.
+        stock = start
+        for name, times in firings:
+            delta, need = rules[name][4:]
+            last = tuple(map(add, stock, [change * (times - 1) for change in delta]))
+            if not (all(map(ge, stock, need)) and all(map(ge, last, need))):
+                return None
+            stock = tuple(map(add, last, delta))
+        return firings, stock, total
+
+    return produce
+
+
+def count_search(crafting, item_index, state, limit):
+    # Plans with counts instead of single steps: picks an order to make the tools in, then for
+    # each step (every tool, then the goal) works out how many times to fire each recipe with
+    # the tools held so far and fires them in batches. Tool orders are tried depth-first,
+    # dropping any that already cost more than the best plan found, so run time depends on the
+    # tools and recipes but hardly at all on how much the goal asks for. The plans are good
+    # but not always optimal: each item is always made the same way, and batches round up.
+    # Returns the same as search(), with the tool orders tried in place of states searched.
+
+    start_time = time()
+    produce = make_batch_producer(crafting, item_index)
+    tools = [item_index[item] for item in find_tools(crafting)]
+    goal = {item_index[item]: amount for item, amount in crafting['Goal'].items()}
+    held = frozenset(i for i in tools if state[i] > 0)
+
+    best_cost = inf
+    best_firings = None
+    best_seen = {}
+    orders_tried = 0
+    # (stock, tools held, cost so far, firings so far)
+    stack = [(state, held, 0, [])]
+    while stack and time() - start_time < limit:
+        stock, held, cost, firings = stack.pop()
+        if best_seen.get((stock, held), inf) <= cost:
+            continue
+        best_seen[(stock, held)] = cost
+        orders_tried += 1
+        result = produce(stock, goal, held)
+        if result and cost + result[2] < best_cost:
+            best_cost = cost + result[2]
+            best_firings = firings + result[0]
+        for tool in tools:
+            if tool in held:
+                continue
+            result = produce(stock, {tool: 1}, held)
+            if result and cost + result[2] < best_cost:
+                stack.append((result[1], held | {tool}, cost + result[2], firings + result[0]))
+
+    if best_firings is None:
+        print(time() - start_time, 'seconds.')
+        print("Failed to find a path within time limit.")
+        return None, None, None, orders_tried
+
+    # Fire the batches one recipe at a time to get the steps of the plan
+    actions = [name for name, times in best_firings for _ in range(times)]
+    return replay_plan(crafting, item_index, state, actions), time() - start_time, best_cost, orders_tried
+
+
+def replay_plan(crafting, item_index, state, actions):
+    # Fires the actions in turn from state and returns the [(state, action)] plan. Raises
+    # ValueError if one of them can't be fired.
+    checkers = {name: make_checker(rule, item_index) for name, rule in crafting['Recipes'].items()}
+    effectors = {name: make_effector(rule, item_index) for name, rule in crafting['Recipes'].items()}
+    pathCells = []
+    for name in actions:
+        if not checkers[name](state):
+            raise ValueError("can't fire %r" % name)
+        state = effectors[name](state)
+        pathCells.append((state, name))
+    return pathCells
+
+
+def make_regression_graph(crafting, item_index):
+    # Backward successors. A state here is a requirement: the least of each item an inventory
+    # has to hold. Going back through a recipe that makes something still required gives
+    # what has to be held just before it: enough to fire it, and enough that firing it
+    # leaves the requirement met.
+    rules = []
+    for name, rule in crafting['Recipes'].items():
+        need, delta = rule_vectors(rule, item_index)
+        produced = [i for i, change in enumerate(delta) if change > 0]
+        rules.append((name, need, delta, produced, rule['Time']))
+
+    def regression_graph(requirement):
+        for name, need, delta, produced, cost in rules:
+            for i in produced:
+                if requirement[i] > 0:
+                    yield (name, tuple(map(max, need, map(sub, requirement, delta))), cost)
+                    break
+
+    return regression_graph
+
+
+def make_regression_heuristic(crafting, item_index, state):
+    # Heuristic for regression: a lower bound on the cost of getting from state to anything
+    # meeting the requirement, worked out like make_bound_heuristic but the other way round.
+    # Say that plan ends holding tool set T. It only fires recipes T allows, none of which adds
+    # more value u_T than it costs, so it costs at least sum(u_T[i] * (f[i] - state[i])) for
+    # the f it ends in, which holds the requirement and one of every tool in T. We take the
+    # smallest such bound over every T holding the required tools that can make what the
+    # requirement asks for. Like --heuristic caps, it also prunes requirements over
+    # compute_caps, since every state meeting one would be too. It doesn't use
+    # make_cap_heuristic's better-recipe and tool rules: they depend on the action, and search
+    # records a pruned requirement's cost, so a requirement one pruned could never be reached
+    # through an action they allow (the forward argument that the better recipe's state beats
+    # it doesn't hold for requirements). It stays a function of the requirement alone.
+    tools = find_tools(crafting)
+    if len(tools) > MAX_BOUND_TOOLS:
+        tools = []
+    tool_bits = tuple((1 << bit, item_index[tool]) for bit, tool in enumerate(tools))
+    held = set(i for i, amount in enumerate(state) if amount > 0)
+
+    options = []
+    for mask in range(1 << len(tools)):
+        tool_set = [i for bit, i in tool_bits if mask & bit]
+        usable = [name for name, rule in crafting['Recipes'].items()
+                  if all(item in tools and mask & tool_bits[tools.index(item)][0]
+                         for item in rule.get('Requires', {}) if item in tools)]
+        # What those recipes can make, starting from what state holds
+        producible = set(held)
+        changed = True
+        while changed:
+            changed = False
+            for name in usable:
+                rule = crafting['Recipes'][name]
+                if all(item_index[item] in producible for item in rule.get('Consumes', {})):
+                    for item in rule['Produces']:
+                        if item_index[item] not in producible:
+                            producible.add(item_index[item])
+                            changed = True
+        if any(i not in producible for i in tool_set):
+            continue
+        values, _ = compute_item_values(crafting, item_index, usable)
+        blockers = tuple(i for i in range(len(item_index)) if i not in producible)
+        options.append((mask, tool_set, values, blockers))
+
+    caps = compute_caps(crafting, item_index)
+    caps = [max(cap, have) for cap, have in zip(caps, state)]
+    whole = all(float(rule['Time']).is_integer() for rule in crafting['Recipes'].values())
+    by_needed = {}
+
+    def regression_heuristic(requirement, action_name):
+        for need, cap in zip(requirement, caps):
+            if need > cap:
+                return inf
+        needed = 0
+        for bit, i in tool_bits:
+            if requirement[i]:
+                needed |= bit
+        candidates = by_needed.get(needed)
+        if candidates is None:
+            candidates = by_needed[needed] = [option for option in options if option[0] & needed == needed]
+        best = inf
+        for mask, tool_set, values, blockers in candidates:
+            if any(requirement[i] > state[i] for i in blockers):
+                continue
+            target = list(requirement)
+            for i in tool_set:
+                target[i] = max(target[i], 1)
+            bound = sum(map(mul, map(sub, target, state), values))
+            if bound < best:
+                best = bound
+        if best == inf:
+            return inf
+        if best <= 0:
+            return 0
+        return ceil(best - 1e-9) if whole else best
+
+    return regression_heuristic
+
+
+def regression_search(crafting, item_index, state, limit, frontier=HeapFrontier):
+    # Searches backwards from the goal over requirements until one is met by state, so only
+    # recipes that make something the goal (eventually) needs are ever tried. Optimal.
+    # Returns the same as search(), with the plan run forwards from state.
+    goal = [0] * len(item_index)
+    for item, amount in crafting['Goal'].items():
+        goal[item_index[item]] = amount
+    plan, time_required, time_cost, states_searched = search(
+        make_regression_graph(crafting, item_index), tuple(goal), lambda requirement: all(map(ge, state, requirement)),
+        limit, make_regression_heuristic(crafting, item_index, state), frontier,
+        RequirementDominanceIndex(crafting, item_index), find_commuting_actions(crafting))
+    if plan is None:
+        return None, None, None, states_searched
+    actions = [action for _, action in reversed(plan)]
+    return replay_plan(crafting, item_index, state, actions), time_required, time_cost, states_searched
+
+
+def bidirectional_search(graph, state, is_goal, limit, heuristic, crafting, item_index, frontier=HeapFrontier,
+                         max_perimeter=1000):
+    # Meets in the middle. First searches backwards from the goal (as regression_search does)
+    # for up to half the time limit or max_perimeter requirements; each one it expands gets
+    # its exact cost to the goal. Then searches forwards, where any state that meets one of
+    # those requirements can jump straight to the goal at that cost. With an admissible
+    # heuristic the plan is still optimal. Returns the same as search().
+    start_time = time()
+    goal = [0] * len(item_index)
+    for item, amount in crafting['Goal'].items():
+        goal[item_index[item]] = amount
+    goal = tuple(goal)
+    regression_graph = make_regression_graph(crafting, item_index)
+    regression_heuristic = make_regression_heuristic(crafting, item_index, state)
+    dominance = RequirementDominanceIndex(crafting, item_index)
+
+    # Backward search, keeping every requirement it expands with its cost and plan to the goal
+    cost_so_far = {goal: 0}
+    came_from = {goal: None}
+    perimeter = []
+    queue = frontier()
+    queue.push(0, goal, 0)
+    states_searched = 0
+    while queue and len(perimeter) < max_perimeter and time() - start_time < limit / 2:
+        _, requirement, pushed_cost = queue.pop()
+        if pushed_cost != cost_so_far[requirement]:
+            continue
+        cost_so_far[requirement] = -1  # expanded
+        states_searched += 1
+        # A requirement another expanded one is inside of, for no more cost, is no use
+        if not any(cost <= pushed_cost and all(map(ge, requirement, other)) for cost, other in perimeter):
+            perimeter.append((pushed_cost, requirement))
+        if all(map(ge, state, requirement)):
+            break
+        for name, before, cost in regression_graph(requirement):
+            new_cost = pushed_cost + cost
+            if (cost_so_far.get(before, inf) <= new_cost or cost_so_far.get(before) == -1
+                    or dominance.dominated(before, new_cost)):
+                continue
+            priority = new_cost + regression_heuristic(before, name)
+            if priority != inf:
+                cost_so_far[before] = new_cost
+                came_from[before] = (requirement, name)
+                queue.push(priority, before, new_cost)
+                dominance.add(before, new_cost, None)
+
+    def finish(requirement):
+        # Forward actions from meeting requirement to the goal
+        actions = []
+        while came_from[requirement] is not None:
+            requirement, name = came_from[requirement]
+            actions.append(name)
+        return actions
+
+    plan, _, time_cost, forward_searched, end_state, met = search_to_targets(
+        graph, state, is_goal, limit - (time() - start_time), heuristic, perimeter, frontier)
+    states_searched += forward_searched
+    if plan is None:
+        return None, None, None, states_searched
+    if met is not None:
+        plan.extend(replay_plan(crafting, item_index, end_state, finish(perimeter[met][1])))
+    return plan, time() - start_time, time_cost, states_searched
+
+
+def search_to_targets(graph, state, is_goal, limit, heuristic, targets, frontier=HeapFrontier):
+    # search(), except that any state holding at least as much of everything as one of the
+    # targets ((cost, state) pairs, in any order) can also finish there at that cost: one last
+    # step to a stand-in goal state, (). Returns what search() does plus the state the plan
+    # ends in and the index of the target it met (None if it reached the goal itself).
+    # (the cheapest target a state meets is the only one worth finishing at)
+    order = sorted(range(len(targets)), key=lambda n: targets[n][0])
+
+    def meeting_graph(current_state):
+        yield from graph(current_state)
+        for n in order:
+            cost, target = targets[n]
+            if all(map(ge, current_state, target)):
+                yield ('finish', (), cost)
+                break
+
+    plan, time_required, time_cost, states_searched = search(
+        meeting_graph, state, lambda current_state: not current_state or is_goal(current_state),
+        limit, lambda current_state, name: heuristic(current_state, name) if current_state else 0, frontier)
+    if plan is None:
+        return None, None, None, states_searched, None, None
+    met = None
+    end_state = plan[-1][0] if plan else state
+    if plan and plan[-1][1] == 'finish':
+        plan.pop()
+        end_state = plan[-1][0] if plan else state
+        met = next(n for n in order if all(map(ge, end_state, targets[n][1])))
+    return plan, time_required, time_cost, states_searched, end_state, met
+
+
+def replan(graph, start, plan, done, delta, limit, crafting, item_index, make_heuristic, frontier=HeapFrontier):
+    # Repairs a plan (as returned by search(), from start) after the first done steps have been
+    # carried out and the inventory then changed by delta ({item: gained, or negative if lost}).
+    # Working back from the goal through the plan (as in make_regression_graph) gives the least
+    # inventory each remaining step needs for the rest of the plan to still work. If the new
+    # inventory has that much for some step from done on, the plan carries on from the latest
+    # such step (gaining items can skip steps) without searching at all. Otherwise it searches
+    # for the cheapest way to get back to what step done needs, with
+    # make_heuristic(crafting with that as its goal), and then carries on with the plan.
+    # Returns the same as search(), for the steps still to do.
+    start_time = time()
+    actions = [action for _, action in plan]
+    current = list(start if done == 0 else plan[done - 1][0])
+    for item, change in delta.items():
+        current[item_index[item]] = max(current[item_index[item]] + change, 0)
+    current = tuple(current)
+
+    requirement = [0] * len(item_index)
+    for item, amount in crafting['Goal'].items():
+        requirement[item_index[item]] = amount
+    requirements = [tuple(requirement)]
+    for action in reversed(actions[done:]):
+        need, change = rule_vectors(crafting['Recipes'][action], item_index)
+        requirements.append(tuple(map(max, need, map(sub, requirements[-1], change))))
+    requirements.reverse()  # requirements[k] is what step done + k needs
+
+    times = [crafting['Recipes'][action]['Time'] for action in actions[done:]]
+    for k in range(len(requirements) - 1, -1, -1):
+        if all(map(ge, current, requirements[k])):
+            return replay_plan(crafting, item_index, current, actions[done + k:]), time() - start_time, sum(times[k:]), 0
+
+    subgoal = {item: requirements[0][i] for item, i in item_index.items() if requirements[0][i] > 0}
+    repair, _, repair_cost, states_searched = search(graph, current, make_goal_checker(subgoal, item_index),
+                                                     limit, make_heuristic(dict(crafting, Goal=subgoal)), frontier)
+    if repair is None:
+        return None, None, None, states_searched
+    end_state = repair[-1][0] if repair else current
+    repair.extend(replay_plan(crafting, item_index, end_state, actions[done:]))
+    return repair, time() - start_time, repair_cost + sum(times), states_searched
+
+
+def find_item_tiers(crafting):
+    # How deep every item sits in the recipe graph: 0 for things made from nothing, otherwise
+    # one more than the deepest item its shallowest recipe requires or eats (wood 0, plank 1,
+    # bench 2, wooden_pickaxe 3, cobble 4, ... ingot 7). Items no recipe can reach get inf.
+    tiers = {item: inf for item in crafting['Items']}
+    for item, amount in crafting['Initial'].items():
+        if amount > 0:
+            tiers[item] = 0
+    changed = True
+    while changed:
+        changed = False
+        for rule in crafting['Recipes'].values():
+            inputs = list(rule.get('Requires', {})) + list(rule.get('Consumes', {}))
+            tier = 1 + max((tiers[item] for item in inputs), default=-1)
+            for item in rule['Produces']:
+                if tier < tiers[item]:
+                    tiers[item] = tier
+                    changed = True
+    return tiers
+
+
+def order_subgoals(crafting):
+    # Splits the goal into steps by tier: the first step asks for every goal item of the
+    # lowest tier, each later one also for the next tier up, and the last is the whole goal.
+    # Earlier items stay in every later step so nothing that's been made gets used up for good.
+    tiers = find_item_tiers(crafting)
+    steps = []
+    for tier in sorted(set(tiers[item] for item in crafting['Goal'])):
+        steps.append({item: amount for item, amount in crafting['Goal'].items() if tiers[item] <= tier})
+    return steps
+
+
+class SubplanCache:
+    """ Remembers the plans for (domain, start inventory, subgoal), dropping the least recently
+        used one past maxsize, where domain is the crafting file's domain_key: the same state
+        tuple means something else under another file's items and recipes. Plans are kept as
+        lists of action names with their end state and cost, so they don't hang on to the print views.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.plans = OrderedDict()  # (domain, state, subgoal items) -> (actions, end state, cost)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, domain, state, subgoal):
+        key = (domain, state, tuple(sorted(subgoal.items())))
+        plan = self.plans.get(key)
+        if plan is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.plans.move_to_end(key)
+        return plan
+
+    def put(self, domain, state, subgoal, actions, end_state, cost):
+        self.plans[(domain, state, tuple(sorted(subgoal.items())))] = (actions, end_state, cost)
+        if len(self.plans) > self.maxsize:
+            self.plans.popitem(last=False)
+
+
+def hierarchical_search(graph, state, crafting, item_index, limit, make_heuristic, domain, frontier=HeapFrontier,
+                        cache=None):
+    # Solves the goal a tier at a time (see order_subgoals), each step from the state the last
+    # one ended in, with make_heuristic(crafting with that step as its goal) as the heuristic.
+    # Each step is looked up in the cache first (under domain, the crafting file's domain_key),
+    # so requests sharing the same early steps only solve them once. Much smaller searches than the whole goal at once, but the steps
+    # are solved greedily, so the plan can cost more than the best one.
+    # Returns the same as search().
+    start_time = time()
+    if cache is None:
+        cache = SubplanCache()
+    pathCells = []
+    total_cost = 0
+    states_searched = 0
+    for subgoal in order_subgoals(crafting):
+        plan = cache.get(domain, state, subgoal)
+        if plan is not None:
+            actions, end_state, cost = plan
+            pathCells.extend(replay_plan(crafting, item_index, state, actions))
+        else:
+            step = dict(crafting, Goal=subgoal)
+            found, _, cost, searched = search(graph, state, make_goal_checker(subgoal, item_index),
+                                              limit - (time() - start_time), make_heuristic(step), frontier)
+            states_searched += searched
+            if found is None:
+                return None, None, None, states_searched
+            actions = [action for _, action in found]
+            end_state = found[-1][0] if found else state
+            cache.put(domain, state, subgoal, actions, end_state, cost)
+            pathCells.extend(found)
+        state = end_state
+        total_cost += cost
+    return pathCells, time() - start_time, total_cost, states_searched
+
+
+# The domain a batch worker process plans in, loaded once by init_batch_worker:
+# (crafting, item_index, graph)
+worker_domain = None
+worker_cache_dir = None
+
+
+def init_batch_worker(crafting_path, cache_dir):
+    # Runs once in every pool process. Loads the compiled domain (compiled once and cached on
+    # disk, so this is just a marshal load) so each problem only has to search.
+    global worker_domain, worker_cache_dir
+    worker_cache_dir = cache_dir
+    compiled = load_compiled_domain(crafting_path, cache_dir)
+    item_index = {item: index for index, item in enumerate(compiled.Crafting['Items'])}
+    worker_domain = (compiled.Crafting, item_index, make_graph([Recipe(*recipe) for recipe in compiled.RECIPES]))
+
+
+# The search modes plan_problem (and so --batch and the planning server) can run
+BATCH_SEARCHES = ('astar', 'counts')
+
+
+def check_batch_options(search_mode, heuristic_name):
+    # Raises ValueError unless plan_problem can run this search mode and heuristic
+    if search_mode not in BATCH_SEARCHES:
+        raise ValueError('search %r is not available here (only %s)' % (search_mode, ', '.join(BATCH_SEARCHES)))
+    if heuristic_name not in HEURISTICS:
+        raise ValueError('unknown heuristic %r' % heuristic_name)
+
+
+def plan_problem(number, initial, goal, limit, search_mode, heuristic_name, stop=None):
+    # Solves one batch problem in a worker. Returns plain data (no State views) so it pickles
+    # cheaply: {'problem', 'actions', 'cost', 'time', 'states_searched'}, with actions None
+    # if no plan was found within limit (or before stop, an Event, was set; counts searches
+    # only look at the limit). Raises ValueError for a search mode or heuristic it can't run.
+    check_batch_options(search_mode, heuristic_name)
+    crafting, item_index, successors = worker_domain
+    crafting = dict(crafting, Initial=initial, Goal=goal)
+    state = [0] * len(item_index)
+    for item, amount in initial.items():
+        state[item_index[item]] = amount
+    state = tuple(state)
+    # Failure messages go to stderr, keeping stdout for results
+    with contextlib.redirect_stdout(sys.stderr):
+        if search_mode == 'counts':
+            plan, time_required, time_cost, states_searched = count_search(crafting, item_index, state, limit)
+        else:
+            plan, time_required, time_cost, states_searched = search(
+                successors, state, make_goal_checker(goal, item_index), limit,
+                choose_heuristic(heuristic_name, crafting, item_index, worker_cache_dir), choose_frontier(crafting),
+                stop=stop)
+    return {'problem': number,
+            'actions': None if plan is None else [action for _, action in plan],
+            'cost': time_cost, 'time': time_required, 'states_searched': states_searched}
+
+
+def plan_batch(crafting_path, problems, limit=30, search_mode='astar', heuristic_name='prune', processes=None,
+               cache_dir=None):
+    # Plans every (initial, goal) problem for one crafting file across a pool of processes,
+    # each with its own time limit, and yields plan_problem's results as they finish (so not
+    # in order; 'problem' is the index into problems). The domain is compiled once and every
+    # worker loads it once, however many problems it gets.
+    check_batch_options(search_mode, heuristic_name)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(crafting_path)), '.craft_cache')
+    load_compiled_domain(crafting_path, cache_dir)  # compile it here, not once per worker
+    with ProcessPoolExecutor(processes, initializer=init_batch_worker, initargs=(crafting_path, cache_dir)) as pool:
+        futures = [pool.submit(plan_problem, number, initial, goal, limit, search_mode, heuristic_name)
+                   for number, (initial, goal) in enumerate(problems)]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# Nodes a parallel_search worker expands between looking at its inbox and sending batches
+HDA_CHUNK = 200
+
+
+def hda_worker(me, crafting_path, cache_dir, heuristic_name, inboxes, results, sent, received, idle, incumbent,
+               stop):
+    # One parallel_search process. It owns the states whose hash lands on it: it keeps their
+    # costs and parents, and expands them from its own frontier. Successors owned by another
+    # worker go to that worker's inbox in batches. It marks itself idle when it has nothing
+    # left that could beat the best plan found so far (incumbent).
+    init_batch_worker(crafting_path, cache_dir)
+    crafting, item_index, successors = worker_domain
+    heuristic = choose_heuristic(heuristic_name, crafting, item_index, cache_dir)
+    is_goal = make_goal_checker(crafting['Goal'], item_index)
+    workers = len(inboxes)
+    inbox = inboxes[me]
+    frontier = HeapFrontier()
+    cost_so_far = {}
+    came_from = {}
+    outgoing = [[] for _ in range(workers)]
+    expanded = 0
+
+    def relax(state, cost, parent, action):
+        if cost < cost_so_far.get(state, inf):
+            cost_so_far[state] = cost
+            came_from[state] = (parent, action)
+            priority = cost + heuristic(state, action or '')
+            if priority != inf:
+                frontier.push(priority, state, cost)
+
+    while not stop.is_set():
+        wait = idle[me]
+        while True:
+            try:
+                batch = inbox.get(timeout=0.01) if wait else inbox.get_nowait()
+            except queue.Empty:
+                break
+            wait = False
+            idle[me] = 0  # (before counting it received, so it never looks finished in between)
+            for node in batch:
+                relax(*node)
+            received[me] += 1
+
+        done = True
+        for _ in range(HDA_CHUNK):
+            if not frontier:
+                break
+            priority, state, cost = frontier.pop()
+            if cost != cost_so_far[state]:
+                continue
+            if priority >= incumbent.value:
+                frontier.push(priority, state, cost)
+                break
+            expanded += 1
+            if is_goal(state):
+                with incumbent.get_lock():
+                    if cost < incumbent.value:
+                        incumbent.value = cost
+                        results.put(('goal', cost, state))
+                continue
+            for name, new_state, step_cost in successors(state):
+                owner = hash(new_state) % workers
+                if owner == me:
+                    relax(new_state, cost + step_cost, state, name)
+                else:
+                    outgoing[owner].append((new_state, cost + step_cost, state, name))
+        else:
+            done = False
+
+        for owner, batch in enumerate(outgoing):
+            if batch:
+                sent[me] += 1
+                inboxes[owner].put(batch)
+                outgoing[owner] = []
+        if done:
+            idle[me] = 1
+
+    # Finished: hand back how much we did, then answer questions about parents for the plan
+    results.put(('done', me, expanded))
+    while True:
+        message = inbox.get()
+        if isinstance(message, tuple):
+            if message[0] == 'quit':
+                break
+            results.put(('parent',) + came_from[message[1]])
+    for other in inboxes:
+        other.cancel_join_thread()
+
+
+def parallel_search(crafting_path, limit, heuristic_name='capped-bound', workers=None, cache_dir=None):
+    # Hash-distributed A* (HDA*): every state belongs to one of workers processes, picked by
+    # its hash, and is only ever expanded there (see hda_worker). Once some worker finds a
+    # plan, everyone drops nodes that can't beat it. It stops when every worker is idle and
+    # every batch sent has been received, which (with an admissible heuristic, so not
+    # 'prune') proves the best plan found is optimal. Returns the same as search(), with
+    # states searched summed over the workers.
+    start_time = time()
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(crafting_path)), '.craft_cache')
+    crafting = load_compiled_domain(crafting_path, cache_dir).Crafting
+    state = [0] * len(crafting['Items'])
+    for item, amount in crafting['Initial'].items():
+        state[crafting['Items'].index(item)] = amount
+    state = tuple(state)
+    workers = workers or os.cpu_count() or 1
+
+    inboxes = [multiprocessing.Queue() for _ in range(workers)]
+    results = multiprocessing.Queue()
+    sent = multiprocessing.Array('q', workers + 1, lock=False)  # the last slot counts our one batch
+    received = multiprocessing.Array('q', workers, lock=False)
+    idle = multiprocessing.Array('b', workers, lock=False)
+    incumbent = multiprocessing.Value('d', inf)
+    stop = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=hda_worker, daemon=True,
+                                         args=(me, crafting_path, cache_dir, heuristic_name, inboxes, results,
+                                               sent, received, idle, incumbent, stop))
+                 for me in range(workers)]
+    for process in processes:
+        process.start()
+
+    sent[workers] = 1
+    inboxes[hash(state) % workers].put([(state, 0, None, None)])
+    best = None
+    quiet = 0
+    while time() - start_time < limit:
+        try:
+            message = results.get(timeout=0.005)
+            if message[0] == 'goal' and (best is None or message[1] < best[0]):
+                best = message[1:]
+            continue
+        except queue.Empty:
+            pass
+        # Finished once everyone has been idle with nothing in flight twice running
+        if all(idle) and sum(sent) == sum(received):
+            quiet += 1
+            if quiet == 2:
+                break
+        else:
+            quiet = 0
+    finished = quiet == 2
+    stop.set()
+
+    states_searched = 0
+    reported = 0
+    while reported < workers:
+        message = results.get()
+        if message[0] == 'goal' and (best is None or message[1] < best[0]):
+            best = message[1:]
+        elif message[0] == 'done':
+            states_searched += message[2]
+            reported += 1
+
+    pathCells = None
+    if finished and best is not None:
+        pathCells = []
+        current = best[1]
+        while current != state:
+            inboxes[hash(current) % workers].put(('parent', current))
+            _, parent, action = results.get()
+            pathCells.append((current, action))
+            current = parent
+        pathCells.reverse()
+    for inbox in inboxes:
+        inbox.put(('quit',))
+    for process in processes:
+        process.join(1)
+
+    if pathCells is None:
+        print(time() - start_time, 'seconds.')
+        print("Failed to find a path within time limit.")
+        return None, None, None, states_searched
+    return pathCells, time() - start_time, best[0], states_searched
+
 
 if __name__ == '__main__':
-    with open('Crafting.json') as f:
-        Crafting = json.load(f)
+    parser = argparse.ArgumentParser(description='Plan a sequence of crafting actions.')
+    parser.add_argument('crafting', nargs='?', default='crafting.json', help='crafting domain JSON file')
+    parser.add_argument('--limit', type=float, default=30, help='search time limit in seconds')
+    parser.add_argument('--graph', choices=['kernels', 'closures', 'incremental'], default='kernels',
+                        help='successor generator: generated per-recipe kernels, per-recipe closures, or kernels that '
+                             'only re-check the recipes the last action could have changed (for big recipe files)')
+    parser.add_argument('--heuristic', choices=HEURISTICS, default='prune',
+                        help='prune: hand-written pruning rules; caps: pruning rules derived from the recipe file; '
+                             'bound: admissible cost lower bound (optimal plans); capped-bound: both of the last two; '
+                             'pdb: capped-bound plus pattern databases saved in the cache directory (optimal plans)')
+    parser.add_argument('--build-pdb', action='store_true',
+                        help='just build the pattern databases for the crafting file and its goal, then stop')
+    parser.add_argument('--frontier', choices=['auto', 'heap', 'bucket'], default='auto',
+                        help='priority queue: bucket queue for whole-number recipe times, binary heap otherwise')
+    parser.add_argument('--search', choices=['astar', 'ida', 'anytime', 'counts', 'backward', 'bidirectional',
+                                             'hierarchical', 'parallel'],
+                        default='astar',
+                        help='astar: normal A*; ida: iterative deepening A* that never holds more than --max-nodes states; '
+                             'anytime: find a plan fast, then keep improving it until --limit; '
+                             'counts: work out how many of each recipe to fire, then order them (fast for big goals, '
+                             'not always optimal); backward: regression from the goal (optimal); '
+                             'bidirectional: regression from the goal, then forward search to meet it; '
+                             'hierarchical: solve the goal a tier of the recipe tree at a time (uses capped-bound '
+                             'when --heuristic is prune); parallel: A* split across --workers processes (optimal '
+                             'with any --heuristic but prune)')
+    parser.add_argument('--max-nodes', type=int, default=1000000,
+                        help='state budget for --search ida')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes for --search parallel (default: one per CPU)')
+    parser.add_argument('--compare-serial', action='store_true',
+                        help='(parallel only) also run the normal search first and print the speedup')
+    parser.add_argument('--stats', choices=['counts', 'timings', 'pruning'], default=None,
+                        help='(astar only) print what the search did: counts; timings: also time spent in graph, '
+                             'heuristic and frontier; pruning: also which heuristic line pruned how many states')
+    parser.add_argument('--profile', default=None,
+                        help='run the search under cProfile and save the profile to this file (not with --stats '
+                             'pruning)')
+    parser.add_argument('--reduce-orders', action='store_true',
+                        help='(astar only) only try independent actions in one order (partial-order reduction)')
+    parser.add_argument('--macros', action='store_true',
+                        help='also search over macro-actions (recipe chains and repeated gathering)')
+    parser.add_argument('--batch', default=None,
+                        help='JSON file with a list of {"Initial": ..., "Goal": ...} problems to plan across a process '
+                             'pool (astar or counts); prints one JSON result per line as each finishes')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes for --batch (default: one per CPU)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='where compiled domains and plans are kept (default: .craft_cache next to the crafting file)')
+    parser.add_argument('--no-plan-cache', action='store_true',
+                        help="don't look up or save plans in the cache")
+    parser.add_argument('--plan-cache-size', type=int, default=256,
+                        help='most plans kept in the cache (least recently used go first)')
+    args = parser.parse_args()
+    if args.profile and args.stats == 'pruning':
+        # (both need the interpreter's profile hook)
+        parser.error("--stats pruning can't be used with --profile")
+    if args.batch and args.search not in BATCH_SEARCHES:
+        parser.error('--batch only runs --search ' + ' or '.join(BATCH_SEARCHES))
+
+    start_time = time()
+    compiled = None
+    cache_dir = args.cache_dir or os.path.join(os.path.dirname(os.path.abspath(args.crafting)), '.craft_cache')
+
+    if args.batch:
+        with open(args.batch) as f:
+            problems = [(problem.get('Initial', {}), problem['Goal']) for problem in json.load(f)]
+        for result in plan_batch(args.crafting, problems, args.limit, args.search, args.heuristic, args.processes,
+                                 cache_dir):
+            print(json.dumps(result), flush=True)
+        sys.exit()
+    if args.graph in ('kernels', 'incremental'):
+        compiled = load_compiled_domain(args.crafting, cache_dir)
+        Crafting = compiled.Crafting
+        domain = compiled.__name__  # (its domain_key)
+    else:
+        with open(args.crafting, 'rb') as f:
+            raw = f.read()
+        Crafting = json.loads(raw)
+        domain = domain_key(raw)
 
     # # List of items that can be in your inventory:
     # print('All items:', Crafting['Items'])
@@ -308,27 +2710,138 @@ if __name__ == '__main__':
     # # Dict of crafting recipes (each is a dict):
     # print('Example recipe:','craft stone_pickaxe at bench ->',Crafting['Recipes']['craft stone_pickaxe at bench'])
 
+    # States are tuples of counts, one slot per item in Crafting['Items'] order
+    item_index = {item: index for index, item in enumerate(Crafting['Items'])}
+    state_view = make_state_view(Crafting['Items'])
+
+    # Initialize first state from initial inventory
+    state = [0] * len(Crafting['Items'])
+    for item, amount in Crafting['Initial'].items():
+        state[item_index[item]] = amount
+    state = tuple(state)
+
+    # Plans found before for the same recipes, initial inventory and goal. One known to be
+    # optimal, or at least as cheap as what these settings found last time, is used as it is;
+    # otherwise its cost bounds the search.
+    exact = (args.search == 'backward'
+             or args.search in ('astar', 'ida', 'bidirectional', 'parallel') and args.heuristic in ('bound', 'capped-bound', 'pdb'))
+    # Every setting that can change which plan comes out
+    mode = ' '.join([args.search, args.heuristic, args.graph, args.frontier]
+                    + [flag for flag, on in (('macros', args.macros), ('reduce-orders', args.reduce_orders)) if on])
+    key = plan_key(Crafting)
+    cached = None if args.no_plan_cache else load_cached_plan(cache_dir, key)
+    use_cached = cached is not None and (cached['optimal'] or mode in cached['modes'])
+
     # Build rules
     all_recipes = []
-    for name, rule in Crafting['Recipes'].items():
-        checker = make_checker(rule)
-        effector = make_effector(rule)
-        recipe = Recipe(name, checker, effector, rule['Time'])
-        all_recipes.append(recipe)
+    if compiled:
+        all_recipes = [Recipe(*recipe) for recipe in compiled.RECIPES]
+    else:
+        for name, rule in Crafting['Recipes'].items():
+            checker = make_checker(rule, item_index)
+            effector = make_effector(rule, item_index)
+            recipe = Recipe(name, checker, effector, rule['Time'])
+            all_recipes.append(recipe)
+
+    successors = make_graph(all_recipes)
+    if args.graph == 'incremental':
+        successors = make_incremental_graph(all_recipes, compiled.AFFECTED)
 
     # Create a function which checks for the goal
-    is_goal = make_goal_checker(Crafting['Goal'])
+    is_goal = make_goal_checker(Crafting['Goal'], item_index)
+
+    if args.build_pdb:
+        for database in load_pattern_databases(Crafting, item_index, cache_dir):
+            print(len(database[2]), 'abstract states over', ', '.join(Crafting['Items'][i] for i in database[0]),
+                  '- the start needs at least', make_pdb_heuristic([database])(state, None))
+        sys.exit()
+    chosen_heuristic = None if use_cached else choose_heuristic(args.heuristic, Crafting, item_index, cache_dir)
+
+    macros = {}
+    if args.macros and not use_cached:
+        macros = derive_macros(Crafting)
+        successors = make_macro_graph(successors, all_recipes, macros, chosen_heuristic)
+        chosen_heuristic = make_macro_heuristic(chosen_heuristic, macros)
+
+    frontier = {'auto': choose_frontier(Crafting), 'heap': HeapFrontier, 'bucket': BucketFrontier}[args.frontier]
 
-    # Initialize first state from initial inventory
-    state = State({key: 0 for key in Crafting['Items']})
-    state.update(Crafting['Initial'])
     # Search for a solution
-    resulting_plan, time_required, time_cost, states_searched = search(graph, state, is_goal, 30, heuristic)
+    fell_back = False  # True when the search gave up and the cached plan is used unproven
+    if use_cached:
+        resulting_plan = replay_plan(Crafting, item_index, state, cached['actions'])
+        time_required, time_cost, states_searched = time() - start_time, cached['cost'], 0
+        print("plan from cache" + (" (optimal)" if cached['optimal'] else ""))
+    elif args.search == 'ida':
+        resulting_plan, time_required, time_cost, states_searched, peak_nodes = memory_bounded_search(
+            successors, state, is_goal, args.limit, chosen_heuristic, args.max_nodes)
+        print("peak nodes held:" + str(peak_nodes))
+    elif args.search == 'counts':
+        resulting_plan, time_required, time_cost, states_searched = count_search(Crafting, item_index, state, args.limit)
+    elif args.search == 'backward':
+        resulting_plan, time_required, time_cost, states_searched = regression_search(
+            Crafting, item_index, state, args.limit, frontier)
+    elif args.search == 'bidirectional':
+        resulting_plan, time_required, time_cost, states_searched = bidirectional_search(
+            successors, state, is_goal, args.limit, chosen_heuristic, Crafting, item_index, frontier)
+    elif args.search == 'hierarchical':
+        # The hand-written heuristic is tuned for the whole goal, so steps use the derived ones
+        step_heuristic = 'capped-bound' if args.heuristic == 'prune' else args.heuristic
+        make_heuristic = lambda step: choose_heuristic(step_heuristic, step, item_index, cache_dir)
+        resulting_plan, time_required, time_cost, states_searched = hierarchical_search(
+            successors, state, Crafting, item_index, args.limit, make_heuristic, domain, frontier)
+    elif args.search == 'parallel':
+        if args.compare_serial:
+            _, serial_time, serial_cost, _ = search(successors, state, is_goal, args.limit, chosen_heuristic, frontier)
+        resulting_plan, time_required, time_cost, states_searched = parallel_search(
+            args.crafting, args.limit, args.heuristic, args.workers, cache_dir)
+        if args.compare_serial and serial_time and time_required:
+            print("serial search: cost " + str(serial_cost) + " in " + str(serial_time) + " seconds, speedup "
+                  + str(serial_time / time_required))
+    elif args.search == 'anytime':
+        resulting_plan = None
+        for resulting_plan, time_required, time_cost, lower_bound, states_searched in anytime_search(
+                successors, state, is_goal, args.limit, chosen_heuristic):
+            # The hand-written pruning heuristic isn't admissible, so it can't vouch for a bound
+            bound_note = "" if args.heuristic == 'prune' else " (optimal cost is at least " + str(lower_bound) + ")"
+            print("found plan costing " + str(time_cost) + " after " + str(time_required) + " seconds" + bound_note)
+    else:
+        skip_after = find_commuting_actions(Crafting) if args.reduce_orders else None
+        # A cached plan's cost is only a safe bound with a heuristic that never overestimates
+        upper_bound = cached['cost'] if cached and args.heuristic != 'prune' else inf
+        # (always kept, to tell a search that ran out of time from one that ran out of states)
+        stats = SearchStats(timings=args.stats in ('timings', 'pruning'), attribute_pruning=args.stats == 'pruning')
+        profiler = cProfile.Profile() if args.profile else None
+        if profiler:
+            profiler.enable()
+        resulting_plan, time_required, time_cost, states_searched = search(successors, state, is_goal, args.limit, chosen_heuristic, frontier, skip_after=skip_after, upper_bound=upper_bound, stats=stats)
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.stats:
+            print(stats.report())
+        if resulting_plan is None and upper_bound != inf:
+            print("using the cached plan instead")
+            resulting_plan = replay_plan(Crafting, item_index, state, cached['actions'])
+            time_required, time_cost = time() - start_time, cached['cost']
+            # Only a search that tried everything under the bound shows nothing beats it; one
+            # that ran out of time says nothing about the cached plan, so it isn't saved again
+            fell_back = not (exact and stats.outcome == 'exhausted')
 
     if resulting_plan:
+        if macros:
+            resulting_plan = expand_macros(resulting_plan, Crafting, item_index, macros)
+        if args.no_plan_cache or use_cached or fell_back:
+            pass
+        elif cached is None or time_cost < cached['cost'] or exact and not cached['optimal']:
+            store_plan(cache_dir, key, [action for _, action in resulting_plan], time_cost, exact, [mode],
+                       args.plan_cache_size)
+        else:
+            # The cached plan is at least as good as these settings find, so use it next time
+            store_plan(cache_dir, key, cached['actions'], cached['cost'], cached['optimal'],
+                       cached['modes'] + [mode], args.plan_cache_size)
         # Print resulting plan
         for state, action in resulting_plan:
-            print('\t',state)
+            print('\t', state_view(state))
             print(action)
         print("compute time:" + str(time_required))
         print("total time cost:" + str(time_cost))
@@ -0,0 +1,219 @@
+import json
+import os
+import argparse
+import asyncio
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import craft_planner
+
+# A resident planning server. It keeps one warm process pool per crafting file (each worker
+# loads the compiled domain once, see craft_planner.init_batch_worker), so a request only pays
+# for its search. Clients connect to a Unix socket (or localhost TCP port) and send one JSON
+# request per line; every reply is one JSON line carrying the request's "id":
+#   {"op": "plan", "id": 1, "crafting": "crafting.json", "initial": {}, "goal": {"cart": 1},
+#    "deadline": 10, "search": "astar", "heuristic": "prune"}
+#       -> {"id": 1, "status": "ok", "actions": [...], "cost": ..., "time": ..., "states_searched": ...}
+#          status is "failed" (no plan within the deadline), "deadline" (it ran out while
+#          queued), "cancelled" or "error" (with a "message"); "search" is "astar" or "counts"
+#          and "heuristic" one of craft_planner.HEURISTICS, anything else is an error
+#   {"op": "cancel", "id": 1}  -> the plan request replies "cancelled"
+#   {"op": "status"}           -> {"status": "ok", "queued": ..., "domains": {path: {...}}}
+# Ids only have to be unique among a client's own requests still running. Cancelling a
+# request replies straight away; a queued one is dropped from its pool's queue, and a search
+# that has already started sees its stop flag within a slice (see craft_planner.search) and
+# frees its worker. Counts searches can't be stopped that way and run out their deadline.
+
+
+def plan_before(deadline_at, stop, number, initial, goal, search_mode, heuristic_name):
+    # Runs in a pool worker: plan_problem with whatever is left of the deadline (wall-clock
+    # seconds since the epoch) and the request's stop flag, or None if it ran out (or was
+    # cancelled) while the request was queued
+    remaining = deadline_at - time.time()
+    if remaining <= 0 or stop.is_set():
+        return None
+    return craft_planner.plan_problem(number, initial, goal, remaining, search_mode, heuristic_name, stop)
+
+
+class DomainPool:
+    """ A process pool whose workers all hold one compiled crafting file, and how many requests
+        are on it. Anything past one per worker is waiting in the pool's queue.
+    """
+
+    def __init__(self, crafting_path, workers, cache_dir):
+        craft_planner.load_compiled_domain(crafting_path, cache_dir)  # compile it once, here
+        with open(crafting_path) as f:
+            crafting = json.load(f)
+        self.initial = crafting['Initial']
+        self.goal = crafting['Goal']
+        self.workers = workers
+        self.in_flight = 0
+        self.executor = ProcessPoolExecutor(workers, initializer=craft_planner.init_batch_worker,
+                                            initargs=(crafting_path, cache_dir))
+
+    def finished(self):
+        self.in_flight -= 1
+
+    def status(self):
+        return {'workers': self.workers, 'in_flight': self.in_flight,
+                'queued': max(self.in_flight - self.workers, 0)}
+
+
+class PlanningServer:
+    """ Answers plan, cancel and status requests (see the top of this file), keeping a DomainPool
+        per crafting file for as long as the server runs.
+    """
+
+    def __init__(self, workers=None, cache_dir=None, default_deadline=30):
+        self.workers = workers or os.cpu_count() or 1
+        self.cache_dir = cache_dir
+        self.default_deadline = default_deadline
+        self.pools = {}  # absolute crafting path -> DomainPool
+        self.manager = None  # started with the first request, for the requests' stop flags
+
+    def pool(self, crafting_path):
+        crafting_path = os.path.abspath(crafting_path)
+        pool = self.pools.get(crafting_path)
+        if pool is None:
+            cache_dir = self.cache_dir or os.path.join(os.path.dirname(crafting_path), '.craft_cache')
+            pool = self.pools[crafting_path] = DomainPool(crafting_path, self.workers, cache_dir)
+        return pool
+
+    def status(self):
+        domains = {path: pool.status() for path, pool in self.pools.items()}
+        return {'status': 'ok', 'queued': sum(domain['queued'] for domain in domains.values()),
+                'in_flight': sum(domain['in_flight'] for domain in domains.values()), 'domains': domains}
+
+    def submit(self, request):
+        # Queues a plan request on its domain's pool straight away (so queue depth is right
+        # from the start), returning its deadline, an asyncio future for the result and the
+        # Event that stops its search. Raises ValueError for a search or heuristic the workers
+        # can't run.
+        search_mode, heuristic_name = request.get('search', 'astar'), request.get('heuristic', 'prune')
+        craft_planner.check_batch_options(search_mode, heuristic_name)
+        deadline = request.get('deadline', self.default_deadline)
+        pool = self.pool(request.get('crafting', 'crafting.json'))
+        if self.manager is None:
+            self.manager = multiprocessing.Manager()
+        stop = self.manager.Event()
+        future = pool.executor.submit(plan_before, time.time() + deadline, stop, request.get('id'),
+                                      request.get('initial', pool.initial), request.get('goal', pool.goal),
+                                      search_mode, heuristic_name)
+        pool.in_flight += 1
+        # Counted until the worker is actually done with it, even if the client gave up on it
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(pool.finished))
+        return deadline, asyncio.wrap_future(future), stop
+
+    async def run(self, request_id, deadline, future, respond, requests):
+        try:
+            # A little slack past the deadline, since the search itself stops on time
+            result = await asyncio.wait_for(future, deadline + 1)
+            if result is None:
+                reply = {'status': 'deadline'}
+            else:
+                reply = result
+                reply.pop('problem')
+                reply['status'] = 'ok' if reply['actions'] is not None else 'failed'
+        except asyncio.TimeoutError:
+            reply = {'status': 'deadline'}
+        except asyncio.CancelledError:
+            reply = {'status': 'cancelled'}
+        except Exception as error:
+            reply = {'status': 'error', 'message': repr(error)}
+        finally:
+            requests.pop(request_id, None)
+        reply['id'] = request_id
+        await respond(reply)
+
+    async def serve_client(self, reader, writer):
+        lock = asyncio.Lock()
+
+        async def respond(reply):
+            async with lock:
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+
+        running = set()
+        requests = {}  # request id -> (future for its result, its stop Event), for this client only
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    await respond({'status': 'error', 'message': 'not JSON'})
+                    continue
+                op = request.get('op', 'plan')
+                request_id = request.get('id')
+                if op == 'plan':
+                    if request_id in requests:
+                        await respond({'id': request_id, 'status': 'error', 'message': 'id already running'})
+                        continue
+                    try:
+                        deadline, future, stop = self.submit(request)
+                    except ValueError as error:
+                        await respond({'id': request_id, 'status': 'error', 'message': str(error)})
+                        continue
+                    except Exception as error:
+                        await respond({'id': request_id, 'status': 'error', 'message': repr(error)})
+                        continue
+                    requests[request_id] = future, stop
+                    task = asyncio.ensure_future(self.run(request_id, deadline, future, respond, requests))
+                    running.add(task)
+                    task.add_done_callback(running.discard)
+                elif op == 'cancel':
+                    if request_id in requests:
+                        future, stop = requests[request_id]
+                        stop.set()  # (stops the search if it has started)
+                        future.cancel()  # (takes it off the pool's queue if it hasn't)
+                elif op == 'status':
+                    await respond(dict(self.status(), id=request_id))
+                else:
+                    await respond({'id': request_id, 'status': 'error', 'message': 'unknown op ' + repr(op)})
+            if running:
+                await asyncio.wait(running)
+        finally:
+            writer.close()
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.executor.shutdown(wait=False, cancel_futures=True)
+        if self.manager is not None:
+            self.manager.shutdown()
+
+
+async def main(args):
+    server = PlanningServer(args.workers, args.cache_dir, args.deadline)
+    for crafting_path in args.preload:
+        server.pool(crafting_path)
+    if args.port:
+        listener = await asyncio.start_server(server.serve_client, '127.0.0.1', args.port)
+    else:
+        listener = await asyncio.start_unix_server(server.serve_client, args.socket)
+    print('planning server listening on', args.port or args.socket, file=sys.stderr)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve crafting plans from warm worker pools.')
+    parser.add_argument('--socket', default='craft_planner.sock', help='Unix socket to listen on')
+    parser.add_argument('--port', type=int, default=None, help='listen on this localhost TCP port instead')
+    parser.add_argument('--workers', type=int, default=None, help='processes per crafting file (default: one per CPU)')
+    parser.add_argument('--deadline', type=float, default=30, help='deadline in seconds for requests without one')
+    parser.add_argument('--cache-dir', default=None,
+                        help='where compiled domains are kept (default: .craft_cache next to each crafting file)')
+    parser.add_argument('--preload', nargs='*', default=[], help='crafting files to warm up before serving')
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass